@@ -100,6 +100,11 @@ of C<computed> means the ID will be assigned using the ID server.
 
 If specified, the work directory will be cleared before running the script.
 
+=item exportSocket
+
+If specified, the Unix socket of a running C<export --socket> server.  The gene-calling step will be sent to the server using
+C<export_client> instead of starting a new C<export> process, so the models are not reloaded for every genome.
+
 =back
 
 =cut
@@ -130,6 +135,7 @@ my $opt = P3Utils::script_opts('workDir', P3Utils::ih_options(), P3Utils::oh_opt
         ["minStrength=f", "minimum strength of a kmer indication", { default => 0.2 }],
         ["clear", "clear the work directory before starting"],
         ["kmerSize|kmer|K=i", "protein kmer size", { default => 8 }],
+        ["exportSocket=s", "Unix socket of a running export server"],
     );
 my $minlen = $opt->minlen;
 my $maxE = $opt->maxe;
@@ -144,6 +150,7 @@ my $genomeID = $opt->id;
 my $minStrength = $opt->minstrength;
 my $kmerSize = $opt->kmersize;
 my $algorithm = $opt->algorithm;
+my $exportSocket = $opt->exportsocket;
 # Connect to PATRIC.
 my $p3 = P3DataAPI->new();
 # Get the positional parameters.
@@ -164,6 +171,11 @@ my @nameSpec;
 if ($nameSuffix) {
     @nameSpec = ('--nameSuffix', $nameSuffix);
 }
+# Create the command name and options for the gene-calling step.
+my @exportSpec = ('export');
+if ($exportSocket) {
+    @exportSpec = ('export_client', '--socket', $exportSocket);
+}
 if (-d $opt->input) {
     # Here we are processing a directory.
     my $outDir = $opt->output;
@@ -260,7 +272,7 @@ sub ProcessGenome {
         [Tax_Comp =>  '*', '--verbose', '--id', $genomeID, @nameSpec, $workDir],
     #    [Close_Anno =>  '*', '--verbose', '--internal', '--maxHits', $maxHits, '--minSim', $minSim, '--maxE', $maxE, $workDir],
         ["kmers.anno" => 'kmers', '*', '--nGenomes', $maxClose, '--minStrength', $minStrength, "-K", $kmerSize, "--algorithm", $algorithm],
-        [export => '*', '--verbose', "$FIG_Config::p3data/RMBGeneCall1"],
+        [@exportSpec, '*', '--verbose', "$FIG_Config::p3data/RMBGeneCall1"],
     #    [Eval_Gto =>  '*', '--verbose', '--eval', $eval, $workDir],
         ["dl4j.eval" =>  'gto', '*', '--verbose', '--format', 'DEEP', '--outDir', $workDir, $eval]
     );
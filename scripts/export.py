@@ -10,14 +10,31 @@ import json
 import numpy as np
 import os
 import re
-import tensorflow as tf
-from keras.models import load_model
-from sklearn.preprocessing import LabelEncoder
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import gzip
+import hashlib
+import io
+import multiprocessing
+import resource
+import socket
+import socketserver
+import tempfile
+import tracemalloc
+import urllib.parse
+import uuid
+import zipfile
 
 
 dnaAll = 'acgtuwsmkrybdhvnz-'
-dnaEncoder = LabelEncoder()
-dnaEncoder.fit(np.array(list(dnaAll)).flatten())
+
+# Byte lookup table giving the code of each character, which is its position in the sorted alphabet (the
+# code a LabelEncoder fitted on dnaAll would give it), with 255 marking characters outside the alphabet
+dnaCodes = np.full((256,), 255, dtype=np.uint8)
+for code, ch in enumerate(sorted(dnaAll)):
+    dnaCodes[ord(ch)] = code
 
 dna2rev = {
     'a': 't',
@@ -40,8 +57,102 @@ dna2rev = {
     '-': '-',
 }
 
+# The character for each code, and the code of each code's complement
+dnaChars = np.frombuffer(''.join(sorted(dnaAll)).encode('ascii'), dtype=np.uint8)
+dnaComplementCodes = dnaCodes[[ord(dna2rev[chr(ch)]) for ch in dnaChars]]
+
 def dna_reverse_complement(dna):
-    return ''.join(dna2rev[i] for i in list(reversed(dna)))
+    return decode_dna(dnaComplementCodes[encode_dna(dna)[::-1]])
+
+def encode_dna(dna):
+    """Encode a DNA string into a uint8 buffer holding the dnaCodes code of each base.
+
+    Arrays are taken to be encoded already and are returned as they are.
+    """
+
+    if isinstance(dna, np.ndarray):
+        return dna
+
+    codes = dnaCodes[np.frombuffer(dna.encode('ascii'), dtype=np.uint8)]
+    if (codes == 255).any():
+        raise ValueError('Sequence contains characters not in %r' % dnaAll)
+
+    return codes
+
+def decode_dna(codes):
+    """Turn a buffer of dnaCodes codes back into a DNA string."""
+
+    return dnaChars[codes].tobytes().decode('ascii')
+
+def gather_windows(codes, locs, width):
+    """Return the width-long windows of codes beginning at each of locs, one window per row."""
+
+    if len(codes) < width:
+        return np.zeros((0, width), dtype=codes.dtype)
+
+    return np.lib.stride_tricks.sliding_window_view(codes, width)[locs]
+
+def codon_hits(seq):
+    """Return the locations of all start and stop codons in an encoded sequence."""
+
+    if len(seq) < 3:
+        empty = np.zeros((0,), dtype=np.int64)
+        return empty, empty
+
+    a = seq[:-2]
+    b = seq[1:-1]
+    c = seq[2:]
+
+    A, G, T = dnaCodes[ord('a')], dnaCodes[ord('g')], dnaCodes[ord('t')]
+
+    # Starts are [agt]tg
+    isStart = (b == T) & (c == G) & ((a == A) | (a == G) | (a == T))
+
+    # Stops are taa, tag and tga
+    isStop = (a == T) & (((b == A) & ((c == A) | (c == G))) | ((b == G) & (c == A)))
+
+    return np.flatnonzero(isStart), np.flatnonzero(isStop)
+
+def orf_table(seq):
+    """Find all ORFs on one strand of an encoded sequence, in columnar form.
+
+    Returns (fronts, backs, frames, starts, bounds), where ORF i spans fronts[i] to backs[i] in frame
+    frames[i] and its in-frame start codons are starts[bounds[i]:bounds[i+1]].  ORFs are ordered by
+    frame and then by position, exactly as the original per-frame scan produced them.
+    """
+
+    startLocs, stopLocs = codon_hits(seq)
+
+    frontsL = []
+    backsL = []
+    framesL = []
+    startsL = []
+    countsL = []
+    for frame in range(3):
+        # Each frame is split into intervals by its stops; the first interval begins at the frame offset
+        stops = np.concatenate(([frame], stopLocs[stopLocs%3 == frame] + 3))
+        starts = startLocs[startLocs%3 == frame]
+
+        # Assign each start to the interval ending at the first stop past it, dropping starts with no stop
+        interval = np.searchsorted(stops, starts, side='right')
+        keep = interval < len(stops)
+        starts = starts[keep]
+        interval = interval[keep]
+
+        # Starts are sorted, so each interval's starts form one contiguous run
+        intervals, counts = np.unique(interval, return_counts=True)
+
+        frontsL.append(stops[intervals-1])
+        backsL.append(stops[intervals])
+        framesL.append(np.full(len(intervals), frame, dtype=np.int64))
+        startsL.append(starts)
+        countsL.append(counts)
+
+    counts = np.concatenate(countsL)
+    bounds = np.zeros((len(counts)+1,), dtype=np.int64)
+    np.cumsum(counts, out=bounds[1:])
+
+    return np.concatenate(frontsL), np.concatenate(backsL), np.concatenate(framesL), np.concatenate(startsL), bounds
 
 def to_sparse_categorical(arr, encoder=None, fit=None, returnEncoder=False):
     """Convert arbitrary categories into numeric categories, and optionally return the encoder."""
@@ -50,6 +161,7 @@ def to_sparse_categorical(arr, encoder=None, fit=None, returnEncoder=False):
         labelEncoder = encoder
         labels = labelEncoder.transform(arr.flatten()).reshape(arr.shape)
     else:
+        from sklearn.preprocessing import LabelEncoder
         labelEncoder = LabelEncoder()
 
         if fit is not None:
@@ -70,6 +182,141 @@ def select_gpu(num, verbose=True):
 
     os.environ['CUDA_VISIBLE_DEVICES'] = str(num)
 
+def parse_cpus(text):
+    """Parse a CPU list such as 0-3,8 into a set of CPU numbers."""
+
+    cpus = set()
+    for part in text.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last)+1))
+        elif part.strip():
+            cpus.add(int(part))
+
+    return cpus
+
+def is_worker():
+    """Return True in a worker process, such as a batch worker, which should not start workers of its own."""
+
+    return multiprocessing.parent_process() is not None
+
+def usable_cpus():
+    """Return the number of CPUs this process may run on."""
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# Rough peak activation bytes per row of a model batch, for sizing batches to a memory budget
+activationRowBytes = 48*2**10
+
+def resource_settings(args):
+    """Fill in the thread counts and memory sizes of args that were not given, and return args.
+
+    Threads default to the CPUs of args.cpus, or else the usable CPUs, shared between batch workers.  Without a memory budget the
+    sizes keep their fixed defaults.  With one, each annotate run gets its share of the budget: 40% for
+    queued model input, 10% for building a large contig at once, and batches whose activations take
+    about 10%.  The rest is left for the models, the genome and the runtime, which the budget does not
+    bound: the sequence, reverse complement and ORFs of the contig being prepared grow with its length.
+    """
+
+    workers = max(getattr(args, 'workers', 1) or 1, 1) if getattr(args, 'batch', None) else 1
+    if getattr(args, 'threads', None) is None:
+        cpus = len(parse_cpus(args.cpus)) if getattr(args, 'cpus', None) else usable_cpus()
+        args.threads = max(cpus // workers, 1)
+    if getattr(args, 'inter_op_threads', None) is None:
+        args.inter_op_threads = min(args.threads, 2)
+    if getattr(args, 'blas_threads', None) is None:
+        args.blas_threads = args.threads
+
+    budget = getattr(args, 'mem_budget', None)
+    if budget:
+        share = budget / workers
+        if args.mem_limit is None:
+            args.mem_limit = max(int(share*0.4), 1)
+        if args.chunk_mb is None:
+            args.chunk_mb = share*0.1
+        if args.batch_size is None:
+            rows = int(share*0.1*2**20) // activationRowBytes
+            args.batch_size = min(max(2**int(np.log2(max(rows, 1))), 256), 4096)
+    if args.mem_limit is None:
+        args.mem_limit = 512
+    if args.chunk_mb is None:
+        args.chunk_mb = 64
+    if args.batch_size is None:
+        args.batch_size = 4096
+
+    return args
+
+def apply_resources(args):
+    """Pin this process to args.cpus and cap its inference and BLAS threads.
+
+    The environment is set as well, so Tensorflow and worker processes started later follow the same
+    limits.  The BLAS pools NumPy already started are capped with threadpoolctl, if it is installed.
+    Returns the effective settings, as resource_report does.
+    """
+
+    if args.cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, parse_cpus(args.cpus))
+
+    resource_settings(args)
+
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS'):
+        os.environ[name] = str(args.blas_threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(args.threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(args.inter_op_threads)
+
+    try:
+        import threadpoolctl
+        threadpoolctl.threadpool_limits(args.blas_threads)
+    except ImportError:
+        pass
+
+    tf_threads()
+
+    return resource_report(args)
+
+def tf_threads():
+    """Set the Tensorflow thread pools from the environment, if Tensorflow is in use and not yet started."""
+
+    if 'tensorflow' not in sys.modules or 'TF_NUM_INTRAOP_THREADS' not in os.environ:
+        return
+
+    tf = sys.modules['tensorflow']
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(int(os.environ['TF_NUM_INTRAOP_THREADS']))
+        tf.config.threading.set_inter_op_parallelism_threads(int(os.environ['TF_NUM_INTEROP_THREADS']))
+    except RuntimeError:
+        # The pools are fixed once Tensorflow has run anything
+        pass
+
+def resource_report(args):
+    """Return the effective resource settings of this process, for schedulers and the metrics."""
+
+    blas = None
+    try:
+        import threadpoolctl
+        blas = [{'library': pool['internal_api'], 'threads': pool['num_threads']} for pool in threadpoolctl.threadpool_info()]
+    except ImportError:
+        pass
+
+    return {
+        'host': socket.gethostname(),
+        'cpus': sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None,
+        'usable_cpus': usable_cpus(),
+        'threads': args.threads,
+        'inter_op_threads': args.inter_op_threads,
+        'blas_threads': args.blas_threads,
+        'blas_pools': blas,
+        'backend': getattr(args, 'backend', None),
+        'workers': getattr(args, 'workers', 1),
+        'prep_workers': getattr(args, 'prep_workers', 1),
+        'mem_budget_mb': getattr(args, 'mem_budget', None),
+        'mem_limit_mb': args.mem_limit,
+        'chunk_mb': args.chunk_mb,
+        'batch_size': args.batch_size,
+    }
+
 def tf_nowarn():
     """Suppress as many warning messages as possible from Tensorflow."""
     # Suppress Tensorflow warnings
@@ -78,8 +325,10 @@ def tf_nowarn():
     # Suppress OpenMP warnings
     os.environ['KMP_WARNINGS'] = 'FALSE'
 
-    # Set Tensorflow log level to only errors
-    tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
+    # Set Tensorflow log level to only errors, if it is in use
+    if 'tensorflow' in sys.modules:
+        tf = sys.modules['tensorflow']
+        tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.ERROR)
 
 class Genome(object):
     """A Genome object facilitates reading and organizing contigs."""
@@ -88,20 +337,21 @@ class Genome(object):
         self.gid = gid
         self.source = source
         self.contigs = []
+        self.contigIndex = {}
         self.gtoDict = {}
         self.last_id = 0
-        # TODO: Change contigs to a dictionary
+        self.sidecar = False
 
         if source is not None:
-            if os.path.isfile(source+'.fna'):
-                self.add_fasta(source+'.fna')
-            if os.path.isfile(source+'.fsa'):
-                self.add_fasta(source+'.fsa')
+            for suffix in ('.fna', '.fsa'):
+                for fname in (source+suffix, source+suffix+'.gz'):
+                    if os.path.isfile(fname):
+                        self.add_fasta(fname)
 
-            if os.path.isfile(source+'.PATRIC.gff'):
-                self.add_gff(source+'.PATRIC.gff')
-            if os.path.isfile(source+'.gff'):
-                self.add_gff(source+'.gff')
+            for suffix in ('.PATRIC.gff', '.gff'):
+                for fname in (source+suffix, source+suffix+'.gz'):
+                    if os.path.isfile(fname):
+                        self.add_gff(fname)
 
             if os.path.isfile(source+'.bam'):
                 self.add_bam(source+'.bam')
@@ -116,92 +366,182 @@ class Genome(object):
             rv += ' source=' + self.source.__repr__()
 
         rv += '; ' + str(len(self.contigs)) + ' contigs'
-        rv += f'; {sum(len(c.dnaPos) for c in self.contigs):,} bp; {100*self.gc:0.1f}% gc'
+        rv += f'; {sum(c.length for c in self.contigs):,} bp; {100*self.gc:0.1f}% gc'
 
         return '<Genome' + rv + '>'
 
     def __repr__(self):
         return self.__str__()
 
+    def add_contig(self, contig):
+        """Add a contig to the end of the genome, keeping the contig ID index current."""
+
+        self.contigs.append(contig)
+        self.contigIndex[contig.cid] = contig
+
     def get_contig_by_id(self, cid):
-        # TODO: Delete this function once the contigs are stored in a dictionary
-        for c in self.contigs:
-            if c.cid == cid:
-                return c
-        return None
+        # Contigs appended to the list directly are picked up by rebuilding the index
+        if cid not in self.contigIndex and len(self.contigIndex) != len(self.contigs):
+            self.contigIndex = {c.cid: c for c in self.contigs}
+
+        return self.contigIndex.get(cid)
 
     def add_fasta(self, fname):
-        """Extracts the sequences from a fasta file into the appropriate contigs."""
+        """Extracts the sequences from a fasta file into the appropriate contigs.
 
-        contig2dna = read_fasta(fname)
+        The sequences of plain files are only read as each contig is used; see read_fasta.
+        """
 
-        for contigId, dna in contig2dna.items():
+        for contigId, length, loader in read_fasta(fname):
             c = self.get_contig_by_id(contigId)
             if c is None:
                 c = Contig(cid=contigId, genome=self)
-                self.contigs.append(c)
-            c.dnaPos = dna
+                self.add_contig(c)
+            c.set_loader(loader, length)
 
     def add_gff(self, fname):
-        """Extracts the features from a .gff file into the appropriate contigs."""
+        """Extracts the features from a .gff file into the appropriate contigs.
+
+        Each feature gets a new fig ID in this genome, numbered on from the features it already has, so
+        that it reads back from a saved GTO as an existing feature.  See read_gff.
+        """
 
         contig2features = read_gff(fname)
+        lastRna = sum(1 for c in self.contigs for f in c.features if f.featureType == 'rna')
 
         for contigId, features in contig2features.items():
             c = self.get_contig_by_id(contigId)
             if c is None:
                 c = Contig(cid=contigId, genome=self)
-                self.contigs.append(c)
-            c.features.extend(features)
+                self.add_contig(c)
+            for f in features:
+                if f.featureType == 'CDS':
+                    self.last_id += 1
+                    f.gtoDict['id'] = 'fig|%s.peg.%d' % (self.gid, self.last_id)
+                else:
+                    lastRna += 1
+                    f.gtoDict['id'] = 'fig|%s.rna.%d' % (self.gid, lastRna)
+                c.add_feature(f)
+
+    def add_bam(self, fname, workers=1, profileDir=None):
+        """Reads .bam and .bam.bai files and computes an RNA-Seq pileup for the sequence.
 
-    def add_bam(self, fname):
-        """Reads .bam and .bam.bai files and computes an RNA-Seq pileup for the sequence."""
+        Contigs are counted by a pool of worker processes when workers is above one.  If profileDir is
+        given, each profile is written there as a .npy file and the contig gets a read-only memory map of it.
+        """
+
+        import pysam
 
         with pysam.AlignmentFile(fname, 'rb') as f:
-            for contigId in sorted(f.references):
-                # contigIdx = int(contigId.split('con.')[-1])
-                # c = self.contigs[contigIdx-1]
+            contigIds = sorted(f.references)
 
-                c = self.get_contig_by_id(contigId)
-                l = f.lengths[f.references.index(contigId)]
+        jobs = []
+        for i, contigId in enumerate(contigIds):
+            outName = os.path.join(profileDir, 'rna%06d.npy' % i) if profileDir is not None else None
+            jobs.append((fname, contigId, outName))
 
-                rnaProfile = np.zeros((l+1,))
+        if profileDir is not None:
+            os.makedirs(profileDir, exist_ok=True)
 
-                pile = f.pileup(contig=contigId)
-                for x in pile:
-                    rnaProfile[x.reference_pos] = min(x.nsegments, 100)
+        # Each worker opens the file for itself, so the pool can be forked from any process but a daemon
+        if workers > 1 and len(jobs) > 1 and not is_worker():
+            with multiprocessing.get_context('fork').Pool(min(workers, len(jobs))) as pool:
+                profiles = pool.starmap(bam_coverage, jobs)
+        else:
+            profiles = [bam_coverage(*job) for job in jobs]
 
-                c.rnaProfile = rnaProfile
+        for (_, contigId, outName), profile in zip(jobs, profiles):
+            c = self.get_contig_by_id(contigId)
+            if c is None:
+                continue
+
+            c.rnaProfile = np.load(profile, mmap_mode='r') if outName is not None else profile
 
     @property
     def gc(self):
         """Calculates the average GC content of all contigs."""
 
-        return sum(c.gc*len(c.dnaPos) for c in self.contigs) / sum(len(c.dnaPos) for c in self.contigs)
+        return sum(c.gc*c.length for c in self.contigs) / sum(c.length for c in self.contigs)
+
+# RNA-Seq coverage is capped at this depth, which also lets it be stored in a uint8
+maxRnaDepth = 100
+
+# Bases of a contig whose RNA-Seq coverage is counted at once
+bamWindow = 2**20
+
+def bam_coverage(fname, contigId, outName=None, window=bamWindow):
+    """Compute the RNA-Seq coverage profile of one contig in an indexed .bam file.
+
+    The reads are counted in bulk by pysam rather than one pileup column at a time, window bases at a
+    time, so the counts never take more than a few times window entries.  The profile has one uint8
+    entry per base, plus one, capped at maxRnaDepth.  It is returned, or if outName is given, it is
+    written to that .npy file and the file name is returned.
+    """
+
+    import pysam
+
+    with pysam.AlignmentFile(fname, 'rb') as f:
+        length = f.get_reference_length(contigId)
+        if outName is not None:
+            profile = np.lib.format.open_memmap(outName, mode='w+', dtype=np.uint8, shape=(length+1,))
+        else:
+            profile = np.zeros((length+1,), dtype=np.uint8)
+
+        # One count array per base, over every aligned base of every read passing the pileup filters
+        depth = np.zeros((min(window, length),), dtype=np.uint32)
+        for start in range(0, length, window):
+            stop = min(start+window, length)
+            part = depth[:stop-start]
+            part[:] = 0
+            for counts in f.count_coverage(contigId, start=start, stop=stop, quality_threshold=0, read_callback='all'):
+                np.add(part, np.frombuffer(counts, dtype='u%d' % counts.itemsize), out=part, casting='unsafe')
+            np.minimum(part, maxRnaDepth, out=profile[start:stop], casting='unsafe')
+
+    if outName is not None:
+        profile.flush()
+        del profile
+        return outName
+
+    return profile
 
 class Contig(object):
-    """A Contig stores a sequence and the features on that sequence."""
+    """A Contig stores a sequence and the features on that sequence.
+
+    The sequence is held once, as a uint8 buffer of dnaCodes codes.  The minus strand and the dnaPos and
+    dnaNeg strings are built from it when asked for.  A contig given a loader with set_loader reads its
+    sequence on first use, and unload lets it go again until the next use.
+    """
+
+    __slots__ = ('cid', 'genome', 'geneticCode', '_codes', '_loader', '_length', '_gc', '_md5', 'rnaProfile', 'coding', 'features', 'orfs', 'stops', 'stopsIndexed')
 
     def __init__(self, cid=None, genome=None):
         self.cid = cid
         self.genome = genome
         self.geneticCode = None
-        self._dnaPos = None
-        self._dnaNeg = None
-        self.gc = None
+        self._codes = None
+        self._loader = None
+        self._length = 0
+        self._gc = None
+        self._md5 = None
         self.rnaProfile = None
         self.coding = None
         self.features = []
         self.orfs = []
 
+        # Stop coordinates of the features on each strand, and how many of the features are indexed
+        self.stops = {'+': set(), '-': set()}
+        self.stopsIndexed = 0
+
     def __str__(self):
         rv = ''
 
         if self.cid is not None:
             rv += ' name=' + self.cid.__repr__()
 
-        if self.dnaPos is not None:
-            rv += f'; {len(self.dnaPos):,} bp; {100*self.gc:0.1f}% gc'
+        if self._codes is not None:
+            rv += f'; {self.length:,} bp; {100*self.gc:0.1f}% gc'
+        elif self._loader is not None:
+            rv += f'; {self.length:,} bp; not loaded'
 
         if self.rnaProfile is not None:
             rv += '; has RNA'
@@ -214,72 +554,106 @@ class Contig(object):
     def __repr__(self):
         return self.__str__()
 
+    def __getstate__(self):
+        # Contigs are sent to worker processes on their own, not with the rest of their genome
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['genome'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def annotate_coding(self, quiet=False):
-        """Create a label for each base pair denoting the coding frame, if any."""
+        """Create a label for each base pair denoting the coding frame, if any.
+
+        Bases of plus strand CDS features are labelled 1, 2, 3 and those of minus strand ones -3, -2, -1,
+        counting frames from the left end.  Later features overwrite earlier ones.
+        """
 
         if not quiet:
             print('WARNING: Minus strand calculation might have off by 1.', file=sys.stderr)
 
-        if not self.dnaPos or not self.features:
+        if not self.length or not self.features:
             return
 
-        self.coding = np.zeros(len(self.dnaPos))
+        self.coding = np.zeros(self.length, dtype=np.int8)
 
-        for feature in self.features:
-            if feature.featureType != 'CDS':
-                continue
+        features = [f for f in self.features if f.featureType == 'CDS']
+        if not features:
+            return
 
+        # Each feature takes a prefix of one repeating frame pattern
+        cycle = (np.arange(max(f.right-f.left for f in features)) % 3 + 1).astype(np.int8)
+        for feature in features:
             if feature.strand == '+':
-                for frame, i in enumerate(range(feature.left, feature.right)):
-                    self.coding[i] = frame%3 + 1
+                self.coding[feature.left:feature.right] = cycle[:feature.right-feature.left]
             else:
-                for frame, i in enumerate(range(feature.left, feature.right)):
-                    self.coding[i] = frame%3 - 3
+                self.coding[feature.left:feature.right] = cycle[:feature.right-feature.left] - 4
+
+    def add_feature(self, feature):
+        """Add a feature to the contig, keeping the stop index current."""
+
+        self.features.append(feature)
+        if self.stopsIndexed == len(self.features)-1:
+            self._index_stop(feature)
+            self.stopsIndexed += 1
+
+    def set_features(self, features):
+        """Replace the features of the contig, and rebuild the stop index."""
+
+        self.features = []
+        self.stops = {'+': set(), '-': set()}
+        self.stopsIndexed = 0
+        for feature in features:
+            self.add_feature(feature)
+
+    def has_stop(self, strand, stop):
+        """Return True if a feature on the strand has its stop at this coordinate.
+
+        The stop of a plus strand feature is its right end, and the stop of a minus strand feature is its left end.
+        """
+
+        # Features added to the list directly are picked up by rebuilding the index
+        if self.stopsIndexed != len(self.features):
+            self.stops = {'+': set(), '-': set()}
+            for feature in self.features:
+                self._index_stop(feature)
+            self.stopsIndexed = len(self.features)
+
+        return stop in self.stops[strand]
+
+    def _index_stop(self, feature):
+        if feature.strand == '+':
+            self.stops['+'].add(feature.right)
+        elif feature.strand == '-':
+            self.stops['-'].add(feature.left)
 
     def find_orfs(self):
         """Traverses the sequence finding all ORFs on both strands."""
 
-        self._find_orfs(self.dnaPos, '+')
-        self._find_orfs(self.dnaNeg, '-')
-
-    def _find_orfs(self, dna, strand):
-        # Store all start codons, organized by frame
-        naL = [[], [], []]
-        for match in re.finditer(r'(?=[agt]tg)', dna):
-            loc = match.start()
-            frame = loc%3
-            naL[frame].append(loc)
-
-        # Store all stop codons, organized by frame
-        noL = [[0], [1], [2]]
-        for match in re.finditer(r'(?=taa|tag|tga)', dna):
-            loc = match.start()
-            frame = loc%3
-            noL[frame].append(loc+3)
-
-        # Find all collections of start codons in frame with stops (ORFs)
-        for frame in range(3):
-            j = -1
-            for i in range(len(noL[frame])-1):
-                front = noL[frame][i]
-                back = noL[frame][i+1]
-
-                # Find all of the potential starts in this ORF to reduce computation later
-                starts = []
-                for j in range(j+1, len(naL[frame])):
-                    # Once we are outside the ORF, stop searching
-                    if naL[frame][j] >= back:
-                        j -= 1
-                        break
-                    starts.append(naL[frame][j])
-
-                # Create an ORF if this section of dna has at least one in-frame start
-                if len(starts) > 0:
-                    if strand == '+':
-                        orf = ORF(front, back, starts, strand, frame)
-                    else:
-                        orf = ORF(len(dna)-back, len(dna)-front, list(reversed([len(dna)-start for start in starts])), strand, frame)
-                    self.orfs.append(orf)
+        self._find_orfs(self.codes('+'), '+')
+        self._find_orfs(self.codes('-'), '-')
+
+    def _find_orfs(self, codes, strand):
+        # Locate every ORF on the strand with array operations
+        fronts, backs, frames, starts, bounds = orf_table(codes)
+
+        # Minus strand ORFs are stored in plus strand coordinates
+        if strand == '-':
+            fronts, backs, starts = len(codes)-backs, len(codes)-fronts, len(codes)-starts
+
+        fronts = fronts.tolist()
+        backs = backs.tolist()
+        frames = frames.tolist()
+        starts = starts.tolist()
+        bounds = bounds.tolist()
+
+        for i in range(len(frames)):
+            orfStarts = starts[bounds[i]:bounds[i+1]]
+            if strand == '-':
+                orfStarts.reverse()
+            self.orfs.append(ORF(fronts[i], backs[i], orfStarts, strand, frames[i]))
 
     def mark_coding_orfs(self, realFeatures):
         """Records which ORFs contain an in-frame feature, and where that feature starts."""
@@ -300,37 +674,108 @@ class Contig(object):
             if feature.left in orfsNeg:
                 orfsNeg[feature.left].realStart = feature.right
 
+    def codes(self, strand='+'):
+        """Return the encoded sequence of one strand; the minus strand is built on each call."""
+
+        codes = self._load()
+        if codes is None or strand == '+':
+            return codes
+
+        return dnaComplementCodes[codes[::-1]]
+
+    def set_codes(self, codes):
+        """Set the sequence from a buffer of dnaCodes codes, and recount its GC content."""
+
+        self._codes = codes
+        self._length = len(codes)
+        self._gc = self._count_gc(codes)
+        self._md5 = None
+
+    def set_loader(self, loader, length):
+        """Have the sequence, of the given length, read by calling loader when it is first used."""
+
+        self._codes = None
+        self._loader = loader
+        self._length = length
+        self._gc = None
+        self._md5 = None
+
+    def unload(self):
+        """Let go of a sequence that can be loaded again, keeping its length, GC content and MD5."""
+
+        if self._loader is not None:
+            self._codes = None
+
+    def _load(self):
+        if self._codes is None and self._loader is not None:
+            codes = self._loader()
+            if len(codes) != self._length:
+                raise ValueError('Contig %s has %d bases, not the %d expected' % (self.cid, len(codes), self._length))
+            md5 = self._md5
+            self.set_codes(codes)
+            self._md5 = md5
+        return self._codes
+
+    def _peek(self):
+        # The sequence, without keeping it if it had to be loaded
+        if self._codes is None and self._loader is not None:
+            return self._loader()
+        return self._codes
+
+    @staticmethod
+    def _count_gc(codes):
+        counts = np.bincount(codes, minlength=len(dnaChars))
+        a, c, g, t = (int(counts[dnaCodes[ord(ch)]]) for ch in 'acgt')
+        return (g+c) / (a+c+g+t) if a+c+g+t > 0 else 0.0
+
+    @property
+    def gc(self):
+        if self._gc is None and self._loader is not None:
+            self._gc = self._count_gc(self._peek())
+        return self._gc
+    @gc.setter
+    def gc(self, gc):
+        self._gc = gc
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def md5(self):
+        """The MD5 of the lower case sequence."""
+
+        if self._md5 is None:
+            codes = self._peek()
+            if codes is None:
+                return None
+            self._md5 = hashlib.md5(dnaChars[codes]).hexdigest()
+        return self._md5
+
     @property
     def dnaPos(self):
-        return self._dnaPos
+        codes = self._load()
+        if codes is None:
+            return None
+        return decode_dna(codes)
     @dnaPos.setter
     def dnaPos(self, dnaPos):
-        self._dnaPos = dnaPos
-        self._dnaNeg = dna_reverse_complement(dnaPos)
-
-        a = self._dnaPos.count('a')
-        c = self._dnaPos.count('c')
-        g = self._dnaPos.count('g')
-        t = self._dnaPos.count('t')
-        self.gc = (g+c) / (a+c+g+t)
+        self.set_codes(encode_dna(dnaPos))
 
     @property
     def dnaNeg(self):
-        return self._dnaNeg
+        if self._load() is None:
+            return None
+        return decode_dna(self.codes('-'))
     @dnaNeg.setter
     def dnaNeg(self, dnaNeg):
-        self._dnaNeg = dnaNeg
-        self._dnaPos = dna_reverse_complement(dnaNeg)
-
-        a = self._dnaPos.count('a')
-        c = self._dnaPos.count('c')
-        g = self._dnaPos.count('g')
-        t = self._dnaPos.count('t')
-        self.gc = (g+c) / (a+c+g+t)
+        self.set_codes(dnaComplementCodes[encode_dna(dnaNeg)[::-1]])
 
 class Feature(object):
     """A section of a sequence with various properties."""
 
+    __slots__ = ('contig', 'left', 'right', 'strand', 'featureType', 'source', 'other', 'gtoDict')
+
     def __init__(self, contig, left, right, strand, featureType, source, other=''):
         self.contig = contig
         self.left = left
@@ -388,6 +833,8 @@ class Feature(object):
 class ORF(object):
     """Specialized feature for open reading frames."""
 
+    __slots__ = ('left', 'right', 'starts', 'strand', 'frame', 'scores', 'realStart')
+
     def __init__(self, left, right, starts, strand, frame):
         self.left = left
         self.right = right
@@ -427,61 +874,529 @@ class ORF(object):
 
         return max(self.scores.values())
 
+# Matches the whitespace between JSON tokens
+jsonSpaceP = re.compile(r'[ \t\n\r]*')
+
+# Characters that may follow a whole JSON value
+jsonDelimiters = ' \t\n\r,:]}'
+
+class JsonObjectReader(object):
+    """Reads the members of a top-level JSON object incrementally, so that large arrays can be streamed.
+
+    Iterate over members() to get each key, and then read its value with value(), or stream the elements
+    of an array value with items().
+    """
+
+    def __init__(self, f, chunkSize=2**20):
+        self.f = f
+        self.chunkSize = chunkSize
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def members(self):
+        """Yield the key of each member of the object."""
+
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def items(self):
+        """Yield the elements of the array at the current position one at a time."""
+
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self._expect(',]') == ']':
+                return
+
+    def value(self):
+        """Decode the JSON value at the current position."""
+
+        self._peek()
+        size = self.chunkSize
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number cut off by the end of the buffer, even just after its "." or "e", continues in the
+                # file, so a value only counts as whole once a delimiter follows it
+                if self.eof or (end < len(self.buf) and self.buf[end] in jsonDelimiters):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            # Read more of the file, in growing pieces so that huge values are not decoded too often
+            self._fill(size)
+            size *= 2
+
+    def _fill(self, size):
+        if self.pos > 0:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+
+        data = self.f.read(size)
+        if data:
+            self.buf += data
+        else:
+            self.eof = True
+
+    def _peek(self):
+        while True:
+            self.pos = jsonSpaceP.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos+1]
+            self._fill(self.chunkSize)
+
+    def _expect(self, chars):
+        ch = self._peek()
+        if ch == '' or ch not in chars:
+            raise ValueError('Expected one of %r in JSON input at %r' % (chars, self.buf[self.pos:self.pos+20]))
+        self.pos += 1
+
+        return ch
+
+class JsonObjectWriter(object):
+    """Writes a top-level JSON object member by member, so that large arrays can be streamed out.
+
+    The output is compact unless pretty is set, in which case it is laid out like json.dump with indent=3.
+    """
+
+    def __init__(self, f, pretty=False):
+        self.f = f
+        self.indent = 3 if pretty else None
+        self.separators = (',', ': ') if pretty else (',', ':')
+        self.empty = True
+
+        self.f.write('{')
+
+    def member(self, key, value):
+        """Write one member of the object."""
+
+        self._key(key)
+        self.f.write(self._dumps(value, 1))
+
+    def array(self, key, values):
+        """Write an array member of the object, taking its elements from an iterable."""
+
+        self._key(key)
+        self.f.write('[')
+
+        empty = True
+        for value in values:
+            if not empty:
+                self.f.write(',')
+            if self.indent:
+                self.f.write('\n' + ' '*(2*self.indent))
+            self.f.write(self._dumps(value, 2))
+            empty = False
+
+        if self.indent and not empty:
+            self.f.write('\n' + ' '*self.indent)
+        self.f.write(']')
+
+    def close(self):
+        """Finish the object."""
+
+        if self.indent and not self.empty:
+            self.f.write('\n')
+        self.f.write('}')
+
+    def _key(self, key):
+        if not self.empty:
+            self.f.write(',')
+        if self.indent:
+            self.f.write('\n' + ' '*self.indent)
+        self.f.write(json.dumps(key) + self.separators[1])
+        self.empty = False
+
+    def _dumps(self, value, depth):
+        text = json.dumps(value, indent=self.indent, separators=self.separators)
+        if self.indent:
+            # Encoded strings never contain a raw newline, so this only shifts the layout
+            text = text.replace('\n', '\n' + ' '*(depth*self.indent))
+
+        return text
+
+# Byte lookup table for FASTA text: dnaCodes for either case, 254 for line ends and spaces, 255 for the rest
+fastaCodes = dnaCodes.copy()
+for ch in dnaAll:
+    fastaCodes[ord(ch.upper())] = dnaCodes[ord(ch)]
+for ch in ' \t\r\n':
+    fastaCodes[ord(ch)] = 254
+
+def open_text(fname):
+    """Open a file for reading in binary, decompressing it if its name ends in .gz."""
+
+    if fname.endswith('.gz'):
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+def encode_fasta(parts):
+    """Encode the sequence lines of a FASTA record, given as a list of byte strings."""
+
+    codes = fastaCodes[np.frombuffer(b''.join(parts), dtype=np.uint8)]
+    codes = codes[codes != 254]
+    if (codes == 255).any():
+        raise ValueError('Sequence contains characters not in %r' % dnaAll)
+
+    return codes
+
+def iter_fasta(f, blockSize=2**20):
+    """Yield the ID and encoded sequence of each record of an open binary FASTA file.
+
+    The file is read in blocks, and only the record being read is held in memory.
+    """
+
+    cid = None
+    parts = []
+    pending = b''
+    while True:
+        block = f.read(blockSize)
+        text = pending + block
+        if block:
+            # Keep any partial last line for the next block
+            cut = text.rfind(b'\n') + 1
+            text, pending = text[:cut], text[cut:]
+        elif text and not text.endswith(b'\n'):
+            text += b'\n'
+
+        pos = 0
+        while pos < len(text):
+            if text.startswith(b'>', pos):
+                end = text.index(b'\n', pos)
+                if cid is not None:
+                    yield cid, encode_fasta(parts)
+                words = text[pos+1:end].split(maxsplit=1)
+                cid = words[0].decode('utf-8') if words else ''
+                parts = []
+                pos = end+1
+            else:
+                nxt = text.find(b'\n>', pos)
+                end = len(text) if nxt < 0 else nxt+1
+                parts.append(text[pos:end])
+                pos = end
+
+        if not block:
+            break
+
+    if cid is not None:
+        yield cid, encode_fasta(parts)
+
+def fasta_index(fname):
+    """Return the .fai index of a plain FASTA file, reading it if it is current and making it if not.
+
+    Each entry is the ID, length, offset of the first base, bases per line and bytes per line of a record,
+    as samtools faidx writes them.  Returns None if the lines of some record vary in length, as such a
+    record cannot be read by offset.  A new index is saved next to the file if the directory allows it.
+    """
+
+    faiName = fname + '.fai'
+    if os.path.isfile(faiName) and os.path.getmtime(faiName) >= os.path.getmtime(fname):
+        with open(faiName) as f:
+            return [(fields[0], int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4])) for fields in (line.rstrip('\n').split('\t') for line in f) if fields[0]]
+
+    index = []
+    with open(fname, 'rb') as f:
+        offset = 0
+        entry = None
+        ended = False
+        for line in f:
+            if line.startswith(b'>'):
+                if entry is not None:
+                    index.append(tuple(entry))
+                words = line[1:].split(maxsplit=1)
+                entry = [words[0].decode('utf-8') if words else '', 0, offset+len(line), 0, 0]
+                ended = False
+            elif entry is not None:
+                # Every line of a record but the last must be as long as the first
+                bases = len(line.rstrip(b'\r\n'))
+                if bases == 0:
+                    ended = True
+                elif ended or (entry[3] > 0 and bases > entry[3]):
+                    return None
+                elif entry[3] == 0:
+                    entry[3], entry[4] = bases, len(line)
+                elif bases < entry[3] or len(line) != entry[4]:
+                    ended = True
+                entry[1] += bases
+            offset += len(line)
+        if entry is not None:
+            index.append(tuple(entry))
+
+    try:
+        with open(faiName, 'w') as f:
+            for entry in index:
+                print(*entry, sep='\t', file=f)
+    except OSError:
+        pass
+
+    return index
+
+def fasta_record(fname, offset, length, lineBases, lineBytes):
+    """Read and encode one record of a plain FASTA file from its .fai entry."""
+
+    if length == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    with open(fname, 'rb') as f:
+        f.seek(offset)
+        data = f.read((length // lineBases)*lineBytes + length % lineBases)
+
+    return encode_fasta([data])
+
+def read_fasta(fname):
+    """Yield the ID, length and a sequence loader of each record of a FASTA file, which may be gzipped.
+
+    Plain files are indexed, so each loader reads its record from disk when it is called.  Gzipped files,
+    and files whose records cannot be indexed, are read in one pass and their loaders return the
+    sequences already read.
+    """
+
+    index = None if fname.endswith('.gz') else fasta_index(fname)
+    if index is not None:
+        for cid, length, offset, lineBases, lineBytes in index:
+            yield cid, length, functools.partial(fasta_record, fname, offset, length, lineBases, lineBytes)
+        return
+
+    with open_text(fname) as f:
+        for cid, codes in iter_fasta(f):
+            yield cid, len(codes), functools.partial(np.asarray, codes)
+
+def gff_attributes(text):
+    """Parse the attributes column of a GFF3 line into a dictionary."""
+
+    attributes = {}
+    for pair in text.split(';'):
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            attributes[key.strip()] = urllib.parse.unquote(value.strip())
+
+    return attributes
+
+def read_gff(fname):
+    """Read the stranded CDS and RNA features of a GFF3 file, which may be gzipped, into lists by contig ID.
+
+    GFF coordinates are 1-based and inclusive, and become 0-based, half-open Feature coordinates.  RNA
+    types other than mRNA become GTO "rna" features.  The source column becomes the feature source, the
+    product attribute the function, and the ID attribute an alias.  Other rows, such as genes, regions
+    and transcripts, are skipped.
+    """
+
+    contig2features = collections.OrderedDict()
+    with open_text(fname) as f:
+        for line in f:
+            line = line.decode('utf-8').rstrip('\r\n')
+            if line.startswith('##FASTA'):
+                break
+            if not line or line.startswith('#'):
+                continue
+
+            fields = line.split('\t')
+            if len(fields) < 8:
+                raise ValueError('Bad GFF line in %s: %r' % (fname, line))
+            if fields[6] not in ('+', '-'):
+                continue
+            if fields[2] == 'CDS':
+                featureType = 'CDS'
+            elif fields[2].endswith('RNA') and fields[2] != 'mRNA':
+                featureType = 'rna'
+            else:
+                continue
+
+            attributes = fields[8] if len(fields) > 8 else ''
+            feature = Feature(fields[0], int(fields[3])-1, int(fields[4]), fields[6], featureType, fields[1], other=attributes)
+            parsed = gff_attributes(attributes)
+            if 'product' in parsed:
+                feature.gtoDict['function'] = parsed['product']
+            if 'ID' in parsed:
+                feature.gtoDict['aliases'] = [parsed['ID']]
+            contig2features.setdefault(fields[0], []).append(feature)
+
+    return contig2features
+
+# Suffix of the binary sequence sidecar of a GTO, and the magic string the sidecar begins with
+sidecarSuffix = '.seq'
+sidecarMagic = b'GTOSEQ1\n'
+
+def write_sidecar(fname, contigs):
+    """Write the encoded sequences of contigs to a binary sequence sidecar, and return its index entries.
+
+    The file is the magic string, the 8-byte length of a JSON index, the index, and then the sequences
+    back to back from a 64-byte boundary.  The index holds the alphabet of the codes and the ID, MD5,
+    offset and length of each contig.  The file is moved into place once written, so readers with the
+    old one mapped are unaffected.
+    """
+
+    entries = []
+    offset = 0
+    for c in contigs:
+        entries.append({'id': c.cid, 'md5': c.md5, 'offset': offset, 'length': c.length})
+        offset += c.length
+    header = json.dumps({'alphabet': dnaChars.tobytes().decode('ascii'), 'contigs': entries}).encode('ascii')
+    dataOffset = -(-(len(sidecarMagic)+8+len(header)) // 64) * 64
+
+    tmpName = '%s.%d.tmp' % (fname, os.getpid())
+    try:
+        with open(tmpName, 'wb') as f:
+            f.write(sidecarMagic)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            f.write(bytes(dataOffset-f.tell()))
+            for c in contigs:
+                f.write(np.ascontiguousarray(c.codes()))
+                c.unload()
+        os.replace(tmpName, fname)
+    except BaseException:
+        os.unlink(tmpName)
+        raise
+
+    return entries
+
+def read_sidecar(fname):
+    """Map a binary sequence sidecar, returning the MD5 and the encoded sequence of each contig by ID.
+
+    The sequences are read-only views of one memory map, so they are only paged in as they are used.
+    """
+
+    with open(fname, 'rb') as f:
+        if f.read(len(sidecarMagic)) != sidecarMagic:
+            raise ValueError('%s is not a sequence sidecar' % fname)
+        size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(size).decode('ascii'))
+    dataOffset = -(-(len(sidecarMagic)+8+size) // 64) * 64
+
+    if sum(entry['length'] for entry in header['contigs']) > 0:
+        data = np.memmap(fname, dtype=np.uint8, mode='r', offset=dataOffset)
+    else:
+        data = np.zeros(0, dtype=np.uint8)
+
+    # Sidecars written with another alphabet are recoded, which reads them in full
+    alphabet = np.frombuffer(header['alphabet'].encode('ascii'), dtype=np.uint8)
+    if not np.array_equal(alphabet, dnaChars):
+        data = dnaCodes[alphabet][data]
+
+    return {entry['id']: (entry['md5'], data[entry['offset']:entry['offset']+entry['length']]) for entry in header['contigs']}
+
 def read_gto(fname):
-    with open(fname) as f:
-        data = json.load(f)
+    """Read a GTO file into a Genome.
 
-    figP = re.compile('fig\\|\\d+\\.\\d+\\.peg\\.(\\d+)')
-    g = Genome(gid=data['id'])
+    Contigs with no "dna" take their sequences from the binary sidecar next to the GTO, as written by
+    save_gto with sidecar set, and the genome is marked as having one.
+    """
+
+    figP = re.compile('fig\\|\\d+\\.\\d+\\.(\\w+)\\.(\\d+)')
+    g = Genome()
     cid2c = {}
+    sequences = None
 
-    for contig in data.pop('contigs'):
-        c = Contig(cid=contig['id'], genome=g)
-        c.dnaPos = contig['dna']
-        c.geneticCode = contig['genetic_code']
-
-        cid2c[c.cid] = c
-        g.contigs.append(c)
-
-    for feature in data.pop('features'):
-        loc = feature.pop('location')[0]
-        start = int(loc[1])-1
-        length = int(loc[3])
-        if loc[2] == '+':
-            left = start
-            right = start+length
-        else:
-            left = start-length+1
-            right = start+1
-        m = figP.match(feature['id'])
-        if m:
-            this_id = int(m.group(1))
-            if g.last_id < this_id:
-                g.last_id = this_id
-            source = 'PATRIC'
-        else:
-            source = 'RMB'
-        f = Feature(contig=loc[0], left=left, right=right, strand=loc[2], featureType=feature.pop('type'), source=source)
-        f.gtoDict = feature
-        cid2c[loc[0]].features.append(f)
+    # Features listed before their contigs wait here
+    orphans = []
+
+    with open(fname) as f:
+        reader = JsonObjectReader(f)
+        for key in reader.members():
+            if key == 'contigs':
+                for contig in reader.items():
+                    c = Contig(cid=contig['id'], genome=g)
+                    if 'dna' in contig:
+                        c.dnaPos = contig['dna']
+                    else:
+                        if sequences is None:
+                            sequences = read_sidecar(fname + sidecarSuffix)
+                            g.sidecar = True
+                        md5, codes = sequences.get(c.cid, (None, None))
+                        if codes is None or contig.get('md5', md5) != md5:
+                            raise ValueError('Contig %s is missing from the sequence sidecar of %s, or has another MD5 there' % (c.cid, fname))
+                        c.set_codes(codes)
+                    c.geneticCode = contig['genetic_code']
+
+                    cid2c[c.cid] = c
+                    g.add_contig(c)
+
+            elif key == 'features':
+                for feature in reader.items():
+                    loc = feature.pop('location')[0]
+                    start = int(loc[1])-1
+                    length = int(loc[3])
+                    if loc[2] == '+':
+                        left = start
+                        right = start+length
+                    else:
+                        left = start-length+1
+                        right = start+1
+                    m = figP.match(feature['id'])
+                    if m:
+                        # Only pegs share the numbering of new RMB calls
+                        this_id = int(m.group(2)) if m.group(1) == 'peg' else 0
+                        if g.last_id < this_id:
+                            g.last_id = this_id
+                        source = 'PATRIC'
+                    else:
+                        source = 'RMB'
+                    f = Feature(contig=loc[0], left=left, right=right, strand=loc[2], featureType=feature.pop('type'), source=source)
+                    f.gtoDict = feature
+                    if loc[0] in cid2c:
+                        cid2c[loc[0]].add_feature(f)
+                    else:
+                        orphans.append(f)
+
+            else:
+                g.gtoDict[key] = reader.value()
+
+    for f in orphans:
+        cid2c[f.contig].add_feature(f)
 
-    g.gtoDict = data
+    g.gid = g.gtoDict['id']
 
     return g
 
-def save_gto(fname, genome):
-    data = genome.gtoDict
+def read_genome(fname, gff=None, gid='99.99', geneticCode=11):
+    """Read a genome from a GTO, or from a FASTA file and the features of an optional GFF file.
 
-    data['contigs'] = []
-    data['features'] = []
+    FASTA input is recognised by its first character, and may be gzipped.  Its contigs are loaded as they
+    are used (see read_fasta) and get the genome ID and genetic code given.
+    """
 
-    for contig in genome.contigs:
-        cD = {}
-        cD['id'] = contig.cid
-        cD['dna'] = contig.dnaPos
-        cD['genetic_code'] = contig.geneticCode
-        data['contigs'].append(cD)
+    with open_text(fname) as f:
+        first = f.read(4096).lstrip()[:1]
+    if first != b'>':
+        return read_gto(fname)
+
+    g = Genome(gid=gid)
+    g.gtoDict = {'id': gid, 'genetic_code': geneticCode}
+    g.add_fasta(fname)
+    if gff:
+        g.add_gff(gff)
+    for c in g.contigs:
+        c.geneticCode = geneticCode
+
+    return g
+
+# Annotator of the features export calls, and tool name of the analysis events it records
+rmbTool = 'export.RMB'
+
+def gto_features(genome, eventId=None):
+    """Yield the GTO dictionary of each feature in the genome, assigning IDs to new RMB features.
 
+    The annotations of new RMB features refer to the analysis event eventId, if given.
+    """
+
+    for contig in genome.contigs:
         for feature in contig.features:
             fD = feature.gtoDict
             fD['type'] = feature.featureType
@@ -490,82 +1405,214 @@ def save_gto(fname, genome):
                 evidence = fD['id']
                 fD['id'] = 'fig|' + str(genome.gid) + '.peg.' + str(genome.last_id)
                 fD['function'] = 'hypothetical protein'
-                fD['annotations'] = [["Hypothetical protein found with evidence " + evidence, "export.RMB", time.time()]]
+                fD['annotations'] = [["Hypothetical protein found with evidence " + evidence, rmbTool, time.time()]]
+                if eventId is not None:
+                    fD['annotations'][0].append(eventId)
             if feature.strand == '+':
                 fD['location'] = [[feature.contig, feature.left+1, feature.strand, feature.right-feature.left]]
             elif feature.strand == '-':
                 fD['location'] = [[feature.contig, feature.right, feature.strand, feature.right-feature.left]]
-            data['features'].append(fD)
+            yield fD
+
+def gto_contigs(genome):
+    """Yield the GTO dictionary of each contig, with its sequence, holding one loaded contig at a time."""
+
+    for c in genome.contigs:
+        yield {'id': c.cid, 'dna': c.dnaPos, 'genetic_code': c.geneticCode}
+        c.unload()
+
+def save_gto(fname, genome, pretty=False, eventId=None, sidecar=False):
+    """Write a Genome to a GTO file.
+
+    With sidecar, the sequences go to a binary sidecar next to the GTO instead, and its contigs only
+    carry their IDs, lengths, MD5s and genetic codes.
+    """
+
+    if sidecar:
+        entries = write_sidecar(fname + sidecarSuffix, genome.contigs)
+        contigs = ({'id': c.cid, 'length': e['length'], 'md5': e['md5'], 'genetic_code': c.geneticCode} for c, e in zip(genome.contigs, entries))
+    else:
+        contigs = gto_contigs(genome)
 
     with open(fname, 'w') as f:
-        json.dump(data, f, indent=3)
+        writer = JsonObjectWriter(f, pretty=pretty)
 
-def calc_loc_preds(dna, starts, stops, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, startModel, stopModel, codingModel):
-    startLocs = []
-    startSamples = []
-    startCodingSamples = []
-    stopLocs = []
-    stopSamples = []
-    stopCodingSamples = []
+        for key, value in genome.gtoDict.items():
+            if key not in ('contigs', 'features'):
+                writer.member(key, value)
 
-    dna = np.array(to_sparse_categorical(list(dna), encoder=dnaEncoder))
+        writer.array('contigs', contigs)
+        writer.array('features', gto_features(genome, eventId))
+        writer.close()
 
-    # Find all possible starts
-    for location, geneLength, orfLength in starts:
-        sample = dna[location-startL:location+3+startR]
-        codingSample = dna[location+3+startR:location+3+startR+codingSize]
-
-        # Sample might have been at the edge of a contig
-        if len(sample) != startL+3+startR:
-            # STILL AN ISSUE
-            # print('WARNING: Edge of contig hit.', file=sys.stderr)
-            continue
-        if len(codingSample) != codingSize:
-            # STILL AN ISSUE
-            # print('WARNING: Edge of contig hit.', file=sys.stderr)
-            continue
+def is_rmb_call(feature):
+    """Return True if export called the feature, in this run or in an earlier one."""
 
-        startLocs.append(location)
-        startSamples.append([sample, geneLength, orfLength, genomeGC, contigGC])
-        startCodingSamples.append([codingSample, genomeGC, contigGC])
+    if feature.source == 'RMB':
+        return True
 
-    # Find all possible stops
-    for location, orfLength in stops:
-        sample = dna[location-stopL:location+3+stopR]
-        codingSample = dna[location-stopL-codingSize:location-stopL]
-
-        # Sample might have been at the edge of a contig
-        if len(sample) != stopL+3+stopR:
-            # STILL AN ISSUE
-            # print('WARNING: Edge of contig hit.', file=sys.stderr)
+    return any(len(annotation) > 1 and annotation[1] == rmbTool for annotation in feature.gtoDict.get('annotations', ()))
+
+def rmb_state(contig):
+    """Hash everything the RMB calls on a contig depend on: its sequence and the stops of its other features."""
+
+    stops = sorted((f.strand, f.right if f.strand == '+' else f.left) for f in contig.features if not is_rmb_call(f))
+    return hashlib.sha1(('%s %r' % (contig.md5, stops)).encode('ascii')).hexdigest()
+
+def rmb_digest(states):
+    """Hash the (contig ID, rmb_state) pairs of a genome into one digest."""
+
+    return hashlib.sha1(''.join('%s %s\n' % (cid, state) for cid, state in states).encode('utf-8')).hexdigest()
+
+def add_rmb_event(genome, fingerprint, contigStates=False):
+    """Record a run in the analysis events of the genome, with the model fingerprint and contig states, and return its ID.
+
+    The event holds one digest over the states of all the contigs, and with contigStates the state of
+    each contig as well, for incremental runs to find the ones that changed.  A run that found the genome
+    as the last run left it, with the same models, is not recorded again, and the ID of the last run's
+    event is returned instead.  Incremental runs with nothing to do thus leave the analysis events as
+    they were.
+    """
+
+    states = [(c.cid, rmb_state(c)) for c in genome.contigs]
+    digest = rmb_digest(states)
+    last = last_rmb_event(genome)
+    if last is not None and last[0] == fingerprint and last[2] == digest:
+        for event in reversed(genome.gtoDict['analysis_events']):
+            if event.get('tool_name') == rmbTool:
+                return event['id']
+
+    parameters = ['model ' + fingerprint, 'states ' + digest]
+    if contigStates:
+        parameters.extend('contig %s %s' % (cid, state) for cid, state in states)
+    event = {
+        'id': str(uuid.uuid4()),
+        'tool_name': rmbTool,
+        'execution_time': time.time(),
+        'parameters': parameters,
+        'hostname': socket.gethostname(),
+    }
+    genome.gtoDict.setdefault('analysis_events', []).append(event)
+
+    return event['id']
+
+def last_rmb_event(genome):
+    """Return the model fingerprint, the contig states and the digest of all the states recorded by the last run on the genome, or None.
+
+    The contig states are empty if the run only recorded the digest.
+    """
+
+    for event in reversed(genome.gtoDict.get('analysis_events', [])):
+        if event.get('tool_name') != rmbTool:
             continue
-        if len(codingSample) != codingSize:
-            # STILL AN ISSUE
-            # print('WARNING: Edge of contig hit.', file=sys.stderr)
+
+        fingerprint = None
+        digest = None
+        states = collections.OrderedDict()
+        for parameter in event.get('parameters', []):
+            name, _, value = parameter.partition(' ')
+            if name == 'model':
+                fingerprint = value
+            elif name == 'states':
+                digest = value
+            elif name == 'contig':
+                cid, _, state = value.rpartition(' ')
+                states[cid] = state
+
+        # Events from before digests were recorded list every contig
+        if digest is None and states:
+            digest = rmb_digest(states.items())
+
+        return fingerprint, states, digest
+
+    return None
+
+def changed_contigs(genome, fingerprint):
+    """Return the contigs whose genes must be called again, after removing their earlier RMB calls.
+
+    A contig is unchanged if the last run used the same models and saw the same sequence and the same
+    other features on it.  Unchanged contigs keep their calls, and so their peg IDs.  If the last run
+    only recorded the digest of all the states, either every contig is unchanged or every one is called
+    again.
+    """
+
+    last = last_rmb_event(genome)
+    if last is None or last[0] != fingerprint:
+        states = {}
+    elif last[1]:
+        states = last[1]
+    elif last[2] == rmb_digest([(c.cid, rmb_state(c)) for c in genome.contigs]):
+        return []
+    else:
+        states = {}
+
+    changed = []
+    for contig in genome.contigs:
+        if states.get(contig.cid) == rmb_state(contig):
             continue
+        contig.set_features([f for f in contig.features if not is_rmb_call(f)])
+        changed.append(contig)
 
-        stopLocs.append(location)
-        stopSamples.append([sample, orfLength, genomeGC, contigGC])
-        stopCodingSamples.append([codingSample, genomeGC, contigGC])
+    return changed
 
-    startSamples = np.array(startSamples)
-    stopSamples = np.array(stopSamples)
-    startCodingSamples = np.array(startCodingSamples)
-    stopCodingSamples = np.array(stopCodingSamples)
+def build_loc_samples(dna, starts, stops, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, stats=None):
+    """Build the model inputs for the candidate starts and stops of one strand.
 
-    # startSamples = np.array([to_sparse_categorical(list(s), encoder=dnaEncoder) for s in startSamples])
-    # stopSamples = np.array([to_sparse_categorical(list(s), encoder=dnaEncoder) for s in stopSamples])
-    # startCodingSamples = np.array([to_sparse_categorical(list(s), encoder=dnaEncoder) for s in startCodingSamples])
-    # stopCodingSamples = np.array([to_sparse_categorical(list(s), encoder=dnaEncoder) for s in stopCodingSamples])
+    Returns the start and stop locations that are clear of the contig edges, followed by the input
+    lists for the start, stop, start coding and stop coding predictions, or None if no start or no
+    stop survives.  The number of windows dropped at the edges is added to stats, if given.
+    """
 
-    if startSamples.size == 0 or stopSamples.size == 0 or startCodingSamples.size == 0 or stopCodingSamples.size == 0:
-        return {}, {}, {}, {}
+    # Every window below is gathered from this one encoded buffer
+    dna = encode_dna(dna)
 
-    # Process the start and stop dna segments
-    startPreds = startModel.predict([np.vstack(startSamples[:,0]), startSamples[:,1], startSamples[:,2], startSamples[:,3], startSamples[:,4]], batch_size=4096)
-    stopPreds = stopModel.predict([np.vstack(stopSamples[:,0]), stopSamples[:,1], stopSamples[:,2], stopSamples[:,3]], batch_size=4096)
-    startCodingPreds = codingModel.predict([np.vstack(startCodingSamples[:,0]), startCodingSamples[:,1], startCodingSamples[:,2]], batch_size=4096)
-    stopCodingPreds = codingModel.predict([np.vstack(stopCodingSamples[:,0]), stopCodingSamples[:,1], stopCodingSamples[:,2]], batch_size=4096)
+    starts = np.array(starts, dtype=np.int64).reshape(-1, 3)
+    stops = np.array(stops, dtype=np.int64).reshape(-1, 2)
+
+    # Samples might have been at the edge of a contig
+    startLocs = starts[:,0]
+    keep = (startLocs-startL >= 0) & (startLocs+3+startR+codingSize <= len(dna))
+    starts = starts[keep]
+    startLocs = startLocs[keep]
+    dropped = len(keep)-len(startLocs)
+
+    stopLocs = stops[:,0]
+    keep = (stopLocs-stopL-codingSize >= 0) & (stopLocs+3+stopR <= len(dna))
+    stops = stops[keep]
+    stopLocs = stopLocs[keep]
+    dropped += len(keep)-len(stopLocs)
+
+    if stats is not None:
+        stats['edge_dropped'] += dropped
+
+    if len(startLocs) == 0 or len(stopLocs) == 0:
+        return None
+
+    # Find all possible starts
+    startSamples = gather_windows(dna, startLocs-startL, startL+3+startR)
+    startCodingSamples = gather_windows(dna, startLocs+3+startR, codingSize)
+
+    # Find all possible stops
+    stopSamples = gather_windows(dna, stopLocs-stopL, stopL+3+stopR)
+    stopCodingSamples = gather_windows(dna, stopLocs-stopL-codingSize, codingSize)
+
+    startGC = [np.full(len(startLocs), genomeGC), np.full(len(startLocs), contigGC)]
+    stopGC = [np.full(len(stopLocs), genomeGC), np.full(len(stopLocs), contigGC)]
+
+    return (
+        startLocs,
+        stopLocs,
+        [startSamples, starts[:,1], starts[:,2], *startGC],
+        [stopSamples, stops[:,1], *stopGC],
+        [startCodingSamples, *startGC],
+        [stopCodingSamples, *stopGC],
+    )
+
+def loc_preds_to_dicts(startLocs, stopLocs, startPreds, stopPreds, startCodingPreds, stopCodingPreds):
+    """Key the start, stop and coding predictions of one strand by location."""
+
+    startLocs = startLocs.tolist()
+    stopLocs = stopLocs.tolist()
 
     startLoc2Pred = dict(zip(startLocs, np.hstack(startPreds)))
     stopLoc2Pred = dict(zip(stopLocs, stopPreds))
@@ -574,6 +1621,54 @@ def calc_loc_preds(dna, starts, stops, genomeGC, contigGC, startL, startR, stopL
 
     return startLoc2Pred, stopLoc2Pred, startLoc2CodingPred, stopLoc2CodingPred
 
+def unique_rows(inputs):
+    """Find the distinct rows of a list of model input columns, comparing every column of a row at once.
+
+    Returns the index of one copy of each distinct row, and for every row the position of its copy in that index.
+    """
+
+    n = len(inputs[0])
+    rowBytes = np.hstack([np.ascontiguousarray(x).reshape(n, -1).view(np.uint8) for x in inputs])
+    keys = np.ascontiguousarray(rowBytes).view(np.dtype((np.void, rowBytes.shape[1]))).ravel()
+    _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    return index, inverse.ravel()
+
+def predict_unique(model, inputs, batch_size=4096):
+    """Run a model over the distinct rows of its inputs only, and fan the predictions back out to every row.
+
+    Returns the predictions and the number of distinct rows.
+    """
+
+    if len(inputs[0]) == 0:
+        return model.predict(inputs, batch_size=batch_size), 0
+
+    index, inverse = unique_rows(inputs)
+    if len(index) == len(inputs[0]):
+        return model.predict(inputs, batch_size=batch_size), len(index)
+
+    preds = model.predict([x[index] for x in inputs], batch_size=batch_size)
+    if isinstance(preds, (list, tuple)):
+        preds = [np.asarray(p)[inverse] for p in preds]
+    else:
+        preds = np.asarray(preds)[inverse]
+
+    return preds, len(index)
+
+def calc_loc_preds(dna, starts, stops, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, startModel, stopModel, codingModel):
+    samples = build_loc_samples(dna, starts, stops, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize)
+    if samples is None:
+        return {}, {}, {}, {}
+    startLocs, stopLocs, startInputs, stopInputs, startCodingInputs, stopCodingInputs = samples
+
+    # Process the start and stop dna segments
+    startPreds, _ = predict_unique(startModel, startInputs, batch_size=4096)
+    stopPreds, _ = predict_unique(stopModel, stopInputs, batch_size=4096)
+    startCodingPreds, _ = predict_unique(codingModel, startCodingInputs, batch_size=4096)
+    stopCodingPreds, _ = predict_unique(codingModel, stopCodingInputs, batch_size=4096)
+
+    return loc_preds_to_dicts(startLocs, stopLocs, startPreds, stopPreds, startCodingPreds, stopCodingPreds)
+
 def combine_orf_preds(orf, startLoc2Pred, stopLoc2Pred, startLoc2CodingPred, stopLoc2CodingPred, dnalen=None):
     if orf.strand == '+':
         stop = orf.right-3
@@ -630,168 +1725,1930 @@ def combine_orf_preds(orf, startLoc2Pred, stopLoc2Pred, startLoc2CodingPred, sto
 
     return pointPredsL, isCorrectL, metaL
 
+class IntervalIndex(object):
+    """A static index of half-open intervals, for finding how much of each of many query intervals is covered.
+
+    The intervals are kept sorted by left end with a running maximum of their right ends.  Of those
+    starting at or before a query, the one reaching furthest right overlaps it most, and is found by
+    binary search.  Those starting inside a query are compared with it one by one, for blocks of queries
+    of at most maxPairs comparisons at a time.  Every interval is kept for as long as the index is.
+    """
+
+    def __init__(self, lefts, rights, maxPairs=2**20):
+        lefts = np.asarray(lefts, dtype=np.int64)
+        rights = np.asarray(rights, dtype=np.int64)
+        order = np.argsort(lefts, kind='stable')
+        self.lefts = lefts[order]
+        self.rights = rights[order]
+        self.reach = np.maximum.accumulate(self.rights) if len(lefts) > 0 else self.rights
+        self.maxPairs = maxPairs
+
+    def __len__(self):
+        return len(self.lefts)
+
+    def best_overlap(self, lefts, rights):
+        """Return the longest overlap of each query interval with any one indexed interval."""
+
+        lefts = np.asarray(lefts, dtype=np.int64)
+        rights = np.asarray(rights, dtype=np.int64)
+        if len(self.lefts) == 0 or len(lefts) == 0:
+            return np.zeros(len(lefts), dtype=np.int64)
+
+        # Intervals starting at or before the query
+        first = np.searchsorted(self.lefts, lefts, side='right')
+        best = np.where(first > 0, np.minimum(rights, self.reach[np.maximum(first-1, 0)]) - lefts, 0)
+
+        # Intervals starting inside the query
+        counts = np.maximum(np.searchsorted(self.lefts, rights, side='left') - first, 0)
+        ends = np.cumsum(counts)
+        q = int(np.searchsorted(ends, 0, side='right'))
+        while q < len(lefts):
+            e = max(int(np.searchsorted(ends, ends[q]-counts[q]+self.maxPairs, side='right')), q+1)
+            blockCounts = counts[q:e]
+            query = np.repeat(np.arange(q, e), blockCounts)
+            offsets = np.arange(len(query)) - np.repeat(np.cumsum(blockCounts)-blockCounts, blockCounts)
+            interval = np.repeat(first[q:e], blockCounts) + offsets
+            np.maximum.at(best, query, np.minimum(rights[query], self.rights[interval]) - self.lefts[interval])
+            q = e
+
+        return np.maximum(best, 0)
+
+class OverlapPruner(object):
+    """A policy for dropping candidate genes that lie mostly inside existing CDS features.
+
+    A candidate start is dropped when a single existing CDS covers at least fraction of the gene running
+    from it to its stop.  strands is 'same', 'opposite' or 'any', for the strands of the features that
+    count.  RMB calls from the current run never count.
+    """
+
+    def __init__(self, fraction, strands='any'):
+        self.fraction = fraction
+        self.strands = strands
+
+    def key(self, contig):
+        """Describe the policy and the features it applies to on a contig, for cache keys."""
+
+        features = sorted((f.left, f.right, f.strand) for f in self._features(contig))
+        return '%r %s %s' % (self.fraction, self.strands, hashlib.sha1(repr(features).encode('ascii')).hexdigest())
+
+    def prune(self, contig, strand, orfs, orfStarts, stats=None):
+        """Return the ORFs on a strand with any starts left, and the starts left for each of them."""
+
+        if strand == '+':
+            other = '-'
+        else:
+            other = '+'
+        strands = {'same': (strand,), 'opposite': (other,), 'any': ('+', '-')}[self.strands]
+        features = [f for f in self._features(contig) if f.strand in strands]
+        index = IntervalIndex([f.left for f in features], [f.right for f in features])
+
+        starts, stops = start_table(orfs, orfStarts, strand)
+        if strand == '+':
+            lefts, rights = starts, stops
+        else:
+            lefts, rights = stops, starts
+        keep = index.best_overlap(lefts, rights) < self.fraction*(rights-lefts)
+
+        return keep_starts(orfs, orfStarts, keep, stats, 'pruned')
+
+    @staticmethod
+    def _features(contig):
+        return [f for f in contig.features if f.featureType == 'CDS' and f.source != 'RMB']
+
+class SequenceFilter(object):
+    """The cheap first stage of cascaded scoring, which drops candidate starts on sequence alone.
+
+    A start is dropped if its gene is shorter than minLength bases, if its start codon is not one of
+    startCodons, or if none of rbsMotifs lies wholly within rbsWindow bases upstream of it.  Filters
+    given as None are not applied.
+    """
+
+    # The span upstream of a start codon searched for a ribosome binding site, as (near, far) offsets
+    rbsWindow = (4, 20)
+
+    def __init__(self, minLength=0, startCodons=None, rbsMotifs=None):
+        self.minLength = minLength
+        self.startCodons = [c.lower() for c in startCodons] if startCodons else None
+        self.rbsMotifs = [m.lower() for m in rbsMotifs] if rbsMotifs else None
+
+    def key(self, contig):
+        """Describe the filter, for cache keys."""
+
+        return '%d %s %s %r' % (self.minLength, self.startCodons, self.rbsMotifs, self.rbsWindow)
+
+    def prune(self, contig, strand, orfs, orfStarts, stats=None):
+        """Return the ORFs on a strand with any starts left, and the starts left for each of them."""
+
+        codes = contig.codes(strand)
+        starts, stops = start_table(orfs, orfStarts, strand)
+
+        # Work in strand coordinates, where every start codon begins at its location
+        if strand == '+':
+            locs, lengths = starts, stops-starts
+        else:
+            locs, lengths = len(codes)-starts, starts-stops
+        keep = lengths >= self.minLength
+
+        if self.startCodons is not None:
+            codons = gather_windows(codes, locs, 3)
+            keep &= np.isin(self._kmer_ids(codons), self._kmer_ids(np.array([encode_dna(c) for c in self.startCodons])))
+
+        if self.rbsMotifs is not None:
+            near, far = self.rbsWindow
+            found = np.zeros(len(locs), dtype=bool)
+            for motif in self.rbsMotifs:
+                # Count the motif hits beginning in the window with a running total of hits
+                hits = (gather_windows(codes, np.arange(max(len(codes)-len(motif)+1, 0)), len(motif)) == encode_dna(motif)).all(axis=1)
+                total = np.concatenate(([0], np.cumsum(hits)))
+                lo = np.clip(locs-far, 0, len(hits))
+                hi = np.clip(locs-near-len(motif)+1, 0, len(hits))
+                found |= total[np.maximum(hi, lo)] > total[lo]
+            keep &= found
+
+        return keep_starts(orfs, orfStarts, keep, stats, 'filtered')
+
+    @staticmethod
+    def _kmer_ids(kmers):
+        ids = np.zeros(len(kmers), dtype=np.int64)
+        for i in range(kmers.shape[1]):
+            ids = ids*len(dnaChars) + kmers[:,i]
+        return ids
+
+class StopGate(object):
+    """The second stage of cascaded scoring, which drops ORFs on their stop and stop coding predictions.
+
+    ORFs whose stop prediction is below minStop, or whose coding prediction ahead of the stop is below
+    minCoding, never have their starts sent to the start, coding or score models.  The coding prediction
+    is the last output of the coding model.
+    """
+
+    def __init__(self, minStop=0.0, minCoding=0.0):
+        self.minStop = minStop
+        self.minCoding = minCoding
+
+    def key(self, contig):
+        """Describe the gate, for cache keys."""
+
+        return '%r %r' % (self.minStop, self.minCoding)
+
+    def passes(self, stopPreds, stopCodingPreds):
+        """Return which stops pass the gate."""
+
+        stopPreds = np.asarray(stopPreds).reshape(len(stopPreds), -1)
+        stopCodingPreds = np.asarray(stopCodingPreds).reshape(len(stopCodingPreds), -1)
+        return (stopPreds[:,0] >= self.minStop) & (stopCodingPreds[:,-1] >= self.minCoding)
+
+# Option values of the export --fast cascade, used for any cascade option not given
+fastCascade = {'min_gene_length': 90, 'min_stop_score': 0.05, 'min_coding_score': 0.05}
+
+def cascade_stages(args):
+    """Build the SequenceFilter and StopGate of the cascade options, each None if it does nothing."""
+
+    options = {name: getattr(args, name, None) for name in ('min_gene_length', 'start_codons', 'rbs_motifs', 'min_stop_score', 'min_coding_score')}
+    if getattr(args, 'fast', False):
+        for name, value in fastCascade.items():
+            if options[name] is None:
+                options[name] = value
+
+    sequenceFilter = None
+    if options['min_gene_length'] or options['start_codons'] or options['rbs_motifs']:
+        sequenceFilter = SequenceFilter(
+            minLength=options['min_gene_length'] or 0,
+            startCodons=options['start_codons'].split(',') if options['start_codons'] else None,
+            rbsMotifs=options['rbs_motifs'].split(',') if options['rbs_motifs'] else None,
+        )
+
+    gate = None
+    if options['min_stop_score'] or options['min_coding_score']:
+        gate = StopGate(options['min_stop_score'] or 0.0, options['min_coding_score'] or 0.0)
+
+    return sequenceFilter, gate
+
+def start_table(orfs, orfStarts, strand):
+    """Return arrays of the starts of some ORFs, and the stop of the ORF of each start, in plus strand coordinates."""
+
+    starts = np.array([start for starts in orfStarts for start in starts], dtype=np.int64)
+    stops = np.repeat(np.array([orf.right if strand == '+' else orf.left for orf in orfs], dtype=np.int64), [len(starts) for starts in orfStarts])
+
+    return starts, stops
+
+def keep_starts(orfs, orfStarts, keep, stats=None, name='pruned'):
+    """Apply a mask over the starts from start_table, dropping ORFs left with no starts.
+
+    The dropped starts and ORFs are counted in stats as name_starts and name_orfs.
+    """
+
+    keptOrfs = []
+    keptStarts = []
+    i = 0
+    for orf, starts in zip(orfs, orfStarts):
+        kept = [start for start, k in zip(starts, keep[i:i+len(starts)]) if k]
+        i += len(starts)
+        if kept:
+            keptOrfs.append(orf)
+            keptStarts.append(kept)
+
+    if stats is not None:
+        stats[name + '_starts'] += len(keep)-int(keep.sum())
+        stats[name + '_orfs'] += len(orfs)-len(keptOrfs)
+
+    return keptOrfs, keptStarts
+
+def strand_chunks(contig, strand, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, overwrite=False, stats=None, maxRows=None, pruners=()):
+    """Build the model inputs for the ORFs on one strand of a contig, a chunk of ORFs at a time.
+
+    Each chunk holds whole ORFs with at most maxRows candidate starts between them, unless a single ORF
+    has more.  Yields the ORFs of each chunk, the strand length and their build_loc_samples result.  The
+    windows are gathered from the whole strand, so the chunks hold exactly what one piece would.
+    Candidates dropped by pruners, such as an OverlapPruner or a SequenceFilter, get no windows, and
+    are then skipped by combine_orf_preds.
+    The ORFs and candidates are counted in stats, if given.
+
+    Chunking only bounds the model inputs built at once.  The encoded strand, and for the minus strand its
+    reverse complement copy, the ORFs of the contig and the indexes of the pruners still cover the whole
+    contig, so they grow with its length.  Chunks wait in the InferenceScheduler queues, which hold up to
+    its memLimit of them whatever their contigs.
+    """
+
+    # ORFs sharing a stop with an existing feature are never scored, so leave them out now
+    dna = contig.codes(strand)
+    if strand == '+':
+        orfs = [orf for orf in contig.orfs if orf.strand == '+' and (overwrite or not contig.has_stop('+', orf.right))]
+    else:
+        orfs = [orf for orf in contig.orfs if orf.strand == '-' and (overwrite or not contig.has_stop('-', orf.left))]
+
+    if stats is not None:
+        stats['orfs'] += len(orfs)
+        stats['candidate_starts'] += sum(len(orf.starts) for orf in orfs)
+        stats['candidate_stops'] += len(orfs)
+
+    orfStarts = [orf.starts for orf in orfs]
+    for pruner in pruners:
+        orfs, orfStarts = pruner.prune(contig, strand, orfs, orfStarts, stats)
+
+    begin = 0
+    while begin < len(orfs):
+        end = begin
+        rows = 0
+        while end < len(orfs) and (end == begin or maxRows is None or rows+len(orfStarts[end]) <= maxRows):
+            rows += len(orfStarts[end])
+            end += 1
+        chunk = list(zip(orfs[begin:end], orfStarts[begin:end]))
+        begin = end
+
+        if strand == '+':
+            starts = [(start, orf.right-start, orf.right-orf.left) for orf, starts in chunk for start in starts]
+            stops = [(orf.right-3, orf.right-orf.left) for orf, starts in chunk]
+        else:
+            starts = [(len(dna)-start, start-orf.left, orf.right-orf.left) for orf, starts in chunk for start in starts]
+            stops = [(len(dna)-orf.left-3, orf.right-orf.left) for orf, starts in chunk]
+        chunk = [orf for orf, starts in chunk]
+
+        samples = build_loc_samples(dna, starts, stops, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, stats)
+        if samples is not None:
+            yield chunk, len(dna), samples
+
+def prepare_strand(contig, strand, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, overwrite=False, stats=None, pruners=()):
+    """Build the model inputs for the ORFs on one strand of a contig.
+
+    Returns the ORFs to score, the strand length and their build_loc_samples result, or None if there
+    is nothing to score.  The ORFs and candidates are counted in stats, if given.
+    """
+
+    for prepared in strand_chunks(contig, strand, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, overwrite, stats, pruners=pruners):
+        return prepared
+
+    return None
+
+def window_row_bytes(startL, startR, stopL, stopR, codingSize):
+    """Return the most bytes of model input queued for each candidate start.
+
+    That is a start row and its coding row, plus a stop row and its coding row, as an ORF has at least one start.
+    """
+
+    # Windows are one byte per base, and lengths and GC contents eight bytes each
+    return (startL+3+startR + 4*8) + (codingSize + 2*8) + (stopL+3+stopR + 3*8) + (codingSize + 2*8)
+
+def prepare_contig(contig, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, overwrite=False, maxRows=None, pruners=()):
+    """Find the ORFs of a contig and build the model inputs for both of its strands.
+
+    This is all of the CPU-bound work for a contig ahead of inference, so it can run in a worker process
+    on a detached copy of the contig.  Returns the ORFs, the prepared strands for
+    InferenceScheduler.add_prepared, and a Counter of timings and counts for Metrics.add_contig.
+
+    A contig with more than maxRows candidate starts is left to be prepared in chunks with strand_chunks,
+    and its prepared strands are None.  Candidates are dropped by each of pruners.
+    """
+
+    stats = collections.Counter()
+
+    t0 = time.perf_counter()
+    contig.find_orfs()
+    t1 = time.perf_counter()
+    if maxRows is not None and sum(len(orf.starts) for orf in contig.orfs) > maxRows:
+        strands = None
+    else:
+        strands = [(strand, prepare_strand(contig, strand, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, overwrite, stats, pruners)) for strand in '+-']
+    t2 = time.perf_counter()
+
+    stats['find_orfs_seconds'] = t1-t0
+    stats['windows_seconds'] = t2-t1
+
+    return contig.orfs, strands, stats
+
+def training_samples(contig, genomeGC, startL, startR, stopL, stopR, codingSize):
+    """Find and label the ORFs of a reference contig, and build the model inputs of both strands for training.
+
+    Every ORF is kept, including those ending at the stop of a CDS, as those hold the positives.  Yields,
+    for each strand with anything to score, the strand, its ORFs, its length, the build_loc_samples result
+    and the int8 labels of the start, stop, startCoding and stopCoding rows.  Start and stop rows are 1 at
+    the start and stop of a CDS, and coding rows get the annotate_coding frame of their first base.
+    """
+
+    contig.orfs = []
+    contig.find_orfs()
+    contig.mark_coding_orfs([f for f in contig.features if f.featureType == 'CDS'])
+    contig.annotate_coding(quiet=True)
+    coding = contig.coding if contig.coding is not None else np.zeros(contig.length, dtype=np.int8)
+
+    for strand in '+-':
+        for orfs, dnalen, samples in strand_chunks(contig, strand, genomeGC, contig.gc, startL, startR, stopL, stopR, codingSize, overwrite=True):
+            startLocs, stopLocs = samples[0], samples[1]
+            real = [orf for orf in orfs if orf.realStart is not None]
+            startCodingLocs = startLocs+3+startR
+            stopCodingLocs = stopLocs-stopL-codingSize
+            if strand == '+':
+                realStarts = [orf.realStart for orf in real]
+                realStops = [orf.right-3 for orf in real]
+            else:
+                realStarts = [dnalen-orf.realStart for orf in real]
+                realStops = [dnalen-orf.left-3 for orf in real]
+                startCodingLocs = dnalen-1-startCodingLocs
+                stopCodingLocs = dnalen-1-stopCodingLocs
+
+            labels = {
+                'start': np.isin(startLocs, realStarts).astype(np.int8),
+                'stop': np.isin(stopLocs, realStops).astype(np.int8),
+                'startCoding': coding[startCodingLocs],
+                'stopCoding': coding[stopCodingLocs],
+            }
+            yield strand, orfs, dnalen, samples, labels
+
+def timed(iterable, stats, key):
+    """Yield from iterable, adding the seconds spent getting each item to stats[key]."""
+
+    it = iter(iterable)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            stats[key] += time.perf_counter()-t0
+        yield item
+
+def ordered_map(pool, func, argsList, ahead):
+    """Run func over argsList in a pool, yielding results in order with at most ahead calls in flight."""
+
+    pending = collections.deque()
+    for funcArgs in argsList:
+        pending.append(pool.apply_async(func, funcArgs))
+        if len(pending) >= ahead:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Return the peak resident memory of this process, or of its finished children, in megabytes."""
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(who).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+def current_rss_mb():
+    """Return the resident memory of this process now, in megabytes, or None where /proc is missing."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+class Metrics(object):
+    """Wall times, memory and counters for one run, saved as a JSON sidecar next to the output GTO.
+
+    Stages are timed with the stage context manager and may be entered many times.  Stages timed
+    elsewhere, such as in worker processes, are added with add_time.  The memory of each stage and
+    scored contig is measured by the memory context manager: the resident memory when it ends, the
+    largest growth in resident memory over one call, and, while tracemalloc is tracing, the peak of the
+    Python and NumPy allocations during a call.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.counters = collections.Counter()
+        self.models = {}
+        self.contigs = []
+        self.resources = None
+        self.tracedPeaks = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            with self.memory(self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})):
+                yield
+        finally:
+            self.add_time(name, time.perf_counter()-t0)
+
+    @contextlib.contextmanager
+    def memory(self, record):
+        """Measure the memory taken by the block into the record dictionary, keeping the largest figures."""
+
+        rss = current_rss_mb()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # The peaks of enclosing blocks are carried past the reset
+            if self.tracedPeaks:
+                self.tracedPeaks[-1] = max(self.tracedPeaks[-1], tracemalloc.get_traced_memory()[1])
+            self.tracedPeaks.append(0)
+            tracemalloc.reset_peak()
+
+        try:
+            yield
+        finally:
+            if tracing and tracemalloc.is_tracing():
+                peak = max(self.tracedPeaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self.tracedPeaks:
+                    self.tracedPeaks[-1] = max(self.tracedPeaks[-1], peak)
+                record['traced_peak_mb'] = max(record.get('traced_peak_mb', 0), peak/2**20)
+            if rss is not None:
+                record['rss_mb'] = current_rss_mb()
+                record['rss_growth_mb'] = max(record.get('rss_growth_mb', 0), record['rss_mb']-rss)
+
+    def add_time(self, name, seconds):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add_predict(self, name, rows, distinct, batchSize):
+        """Record one predict call on a model."""
+
+        model = self.models.setdefault(name, {'predict_calls': 0, 'rows': 0, 'distinct_rows': 0, 'batches': 0, 'largest_call': 0})
+        model['predict_calls'] += 1
+        model['rows'] += rows
+        model['distinct_rows'] += distinct
+        model['batches'] += -(-distinct // batchSize)
+        model['largest_call'] = max(model['largest_call'], distinct)
+        self.count('predict_calls')
+
+    def add_contig(self, contig, status, stats=None, memory=None):
+        """Record a contig, its status (scored, cached, resumed or unchanged), its prepare_contig stats and its memory."""
+
+        entry = {'id': contig.cid, 'length': contig.length, 'status': status}
+        if memory:
+            entry.update(memory)
+        if stats:
+            entry.update(stats)
+            for name in ('orfs', 'candidate_starts', 'candidate_stops', 'edge_dropped', 'pruned_starts', 'pruned_orfs', 'filtered_starts', 'filtered_orfs'):
+                self.count(name, stats.get(name, 0))
+            self.add_time('find_orfs', stats['find_orfs_seconds'])
+            self.add_time('build_windows', stats['windows_seconds'])
+        self.contigs.append(entry)
+        self.count('contigs_' + status)
+        self.count('bp', contig.length)
+
+    def as_dict(self):
+        elapsed = time.time()-self.started
+        return {
+            'started': self.started,
+            'seconds': elapsed,
+            'bp_per_second': self.counters['bp']/elapsed if elapsed > 0 else 0,
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'stages': self.stages,
+            'counters': dict(self.counters),
+            'models': self.models,
+            'resources': self.resources,
+            'contigs': self.contigs,
+        }
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.as_dict(), f, indent=3)
+
+    def report(self, f=sys.stderr):
+        """Print a summary of the stages and counters."""
+
+        for name, stage in self.stages.items():
+            print('  %-20s %9.3f s in %d calls' % (name, stage['seconds'], stage['calls']), file=f)
+        for name, value in sorted(self.counters.items()):
+            print('  %-20s %9d' % (name, value), file=f)
+        print('  %-20s %9.1f MB' % ('peak memory', peak_rss_mb()), file=f)
+
+class StrandJob(object):
+    """The ORFs of one contig strand whose model inputs are waiting in an InferenceScheduler."""
+
+    def __init__(self, contig, strand, dnalen, orfs, startLocs, stopLocs):
+        self.contig = contig
+        self.strand = strand
+        self.dnalen = dnalen
+        self.orfs = orfs
+        self.startLocs = startLocs
+        self.stopLocs = stopLocs
+        self.preds = {}
+        self.held = None
+
+class InferenceScheduler(object):
+    """Runs the RMB models over every ORF, strand and contig of a genome in large batches.
+
+    Contigs are queued with add_contig.  Their start, stop and coding inputs are held until the queued
+    inputs reach memLimit bytes, and then each model is run once over everything queued, batchSize rows
+    at a time.  The resulting score model rows are queued and flushed the same way, and the scores are
+    scattered back to orf.scores and to new RMB features on each contig.  Call finish to drain the queues.
+
+    With dedup, each model only sees the distinct rows of its queued inputs.  The rows and distinct rows
+    sent to each model are counted in rowCounts.  Model calls, combining and calling are timed and counted
+    in metrics.
+
+    With a StopGate, the start inputs of a strand are held back until its stops are predicted, and only
+    those of ORFs passing the gate are queued for the start and coding models.
+
+    With a ContigJournal, contigs marked with end_contig are journaled by the flush after which all their
+    ORFs are scored.
+    """
+
+    def __init__(self, startModel, stopModel, codingModel, scoreModel, cutoff=0.5, startL=90, startR=90, stopL=90, stopR=90, codingSize=33, overwrite=False, batchSize=4096, memLimit=512*2**20, dedup=True, metrics=None, gate=None, journal=None):
+        self.models = {
+            'start': startModel,
+            'stop': stopModel,
+            'startCoding': codingModel,
+            'stopCoding': codingModel,
+            'score': scoreModel,
+        }
+        self.queues = {name: [] for name in self.models}
+        self.queuedBytes = 0
+        self.cutoff = cutoff
+        self.startL = startL
+        self.startR = startR
+        self.stopL = stopL
+        self.stopR = stopR
+        self.codingSize = codingSize
+        self.overwrite = overwrite
+        self.batchSize = batchSize
+        self.memLimit = memLimit
+        self.dedup = dedup
+        self.rowCounts = {name: [0, 0] for name in self.models}
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.gate = gate
+        self.journal = journal
+        self.ended = []
+
+    def add_contig(self, contig, genomeGC, contigGC):
+        """Queue the ORFs on both strands of a contig for scoring."""
+
+        strands = [(strand, prepare_strand(contig, strand, genomeGC, contigGC, self.startL, self.startR, self.stopL, self.stopR, self.codingSize, self.overwrite)) for strand in '+-']
+        self.add_prepared(contig, strands)
+
+    def finish(self):
+        """Score everything still queued."""
+
+        self.flush()
+
+    def flush(self):
+        """Run each model over its queued inputs, and then the score model over the resulting rows."""
+
+        # Stops go first, so starts passing a gate are queued in time for this flush
+        for name in ('stop', 'stopCoding', 'start', 'startCoding', 'score'):
+            self._run(name)
+
+        # Everything queued before the flush is scored now, so the contigs ended by then are finished
+        if self.journal is not None and self.ended:
+            with self.metrics.stage('journal'):
+                for contig, key in self.ended:
+                    self.journal.add(contig, key)
+                self.journal.sync()
+            self.ended = []
+
+    def end_contig(self, contig, key=None):
+        """Mark every ORF of a contig as queued, so it is journaled under the key once they are scored."""
+
+        if self.journal is not None:
+            self.ended.append((contig, key))
+
+    def add_prepared(self, contig, strands):
+        """Queue the strands of a contig that were already prepared with prepare_contig."""
+
+        for strand, prepared in strands:
+            if prepared is None:
+                continue
+            orfs, dnalen, samples = prepared
+            startLocs, stopLocs, startInputs, stopInputs, startCodingInputs, stopCodingInputs = samples
+
+            job = StrandJob(contig, strand, dnalen, orfs, startLocs, stopLocs)
+            if self.gate is None:
+                self._queue_starts(job, startInputs, startCodingInputs)
+            else:
+                job.held = (startInputs, startCodingInputs)
+                self.queuedBytes += sum(x.nbytes for inputs in job.held for x in inputs)
+            self._queue('stop', stopInputs, functools.partial(self._loc_preds_done, job, 'stop'))
+            self._queue('stopCoding', stopCodingInputs, functools.partial(self._loc_preds_done, job, 'stopCoding'))
+
+        if self.queuedBytes >= self.memLimit:
+            self.flush()
+
+    def _queue_starts(self, job, startInputs, startCodingInputs):
+        self._queue('start', startInputs, functools.partial(self._loc_preds_done, job, 'start'))
+        self._queue('startCoding', startCodingInputs, functools.partial(self._loc_preds_done, job, 'startCoding'))
+
+    def _queue(self, name, inputs, callback):
+        self.queues[name].append((inputs, callback))
+        self.queuedBytes += sum(x.nbytes for x in inputs)
+
+    def _run(self, name):
+        queue = self.queues[name]
+        if len(queue) == 0:
+            return
+        self.queues[name] = []
+        self.queuedBytes -= sum(x.nbytes for inputs, callback in queue for x in inputs)
+
+        # Stack the queued inputs column by column and predict them in one call
+        inputs = [np.concatenate([q[0][i] for q in queue]) for i in range(len(queue[0][0]))]
+        with self.metrics.stage('predict_' + name):
+            if self.dedup:
+                preds, distinct = predict_unique(self.models[name], inputs, batch_size=self.batchSize)
+            else:
+                preds = self.models[name].predict(inputs, batch_size=self.batchSize)
+                distinct = len(inputs[0])
+        self.rowCounts[name][0] += len(inputs[0])
+        self.rowCounts[name][1] += distinct
+        self.metrics.add_predict(name, len(inputs[0]), distinct, self.batchSize)
+
+        # Scatter the predictions back to the callers in queue order
+        offsets = np.cumsum([len(q[0][0]) for q in queue])[:-1]
+        if isinstance(preds, (list, tuple)):
+            parts = list(zip(*[np.split(p, offsets) for p in preds]))
+        else:
+            parts = np.split(preds, offsets)
+
+        for (inputs, callback), part in zip(queue, parts):
+            callback(part)
+
+    def _loc_preds_done(self, job, name, preds):
+        job.preds[name] = preds
+        if job.held is not None and 'stop' in job.preds and 'stopCoding' in job.preds:
+            self._gate(job)
+            return
+        if len(job.preds) < 4:
+            return
+
+        with self.metrics.stage('combine_orf_preds'):
+            self._combine(job)
+
+    def _gate(self, job):
+        """Queue the held start inputs of the ORFs on a strand whose stops pass the gate."""
+
+        startInputs, startCodingInputs = job.held
+        job.held = None
+        self.queuedBytes -= sum(x.nbytes for inputs in (startInputs, startCodingInputs) for x in inputs)
+
+        passes = self.gate.passes(job.preds['stop'], job.preds['stopCoding'])
+        failed = set(job.stopLocs[~passes].tolist())
+        if job.strand == '+':
+            orfs = [orf for orf in job.orfs if orf.right-3 not in failed]
+            locs = [start for orf in orfs for start in orf.starts]
+        else:
+            orfs = [orf for orf in job.orfs if job.dnalen-orf.left-3 not in failed]
+            locs = [job.dnalen-start for orf in orfs for start in orf.starts]
+        keep = np.isin(job.startLocs, locs)
+
+        self.metrics.count('gated_orfs', len(failed))
+        self.metrics.count('gated_starts', len(keep)-int(keep.sum()))
+
+        job.orfs = orfs
+        job.startLocs = job.startLocs[keep]
+        if keep.any():
+            self._queue_starts(job, [x[keep] for x in startInputs], [x[keep] for x in startCodingInputs])
+
+    def _combine(self, job):
+        startLoc2Pred, stopLoc2Pred, startLoc2CodingPred, stopLoc2CodingPred = loc_preds_to_dicts(
+            job.startLocs,
+            job.stopLocs,
+            job.preds['start'],
+            job.preds['stop'],
+            job.preds['startCoding'],
+            job.preds['stopCoding'],
+        )
+        job.preds = {}
+
+        orfs = []
+        rows = []
+        meta = []
+        bounds = [0]
+        for orf in job.orfs:
+            pointPreds, isCorrect, orfMeta = combine_orf_preds(
+                orf,
+                startLoc2Pred,
+                stopLoc2Pred,
+                startLoc2CodingPred,
+                stopLoc2CodingPred,
+                dnalen=job.dnalen,
+            )
+
+            if len(pointPreds) == 0:
+                continue
+
+            orfs.append(orf)
+            rows.extend(pointPreds)
+            meta.extend(orfMeta)
+            bounds.append(len(rows))
+
+        if len(rows) > 0:
+            self.metrics.count('scored_starts', len(rows))
+            self._queue('score', [np.array(rows)], functools.partial(self._scores_done, job, orfs, meta, bounds))
+
+    def _scores_done(self, job, orfs, meta, bounds, scores):
+        scores = np.ravel(scores)
+
+        # Plus strand ORFs are keyed by their left end and minus strand ORFs by their right end
+        key = 0 if job.strand == '+' else 1
+
+        for i, orf in enumerate(orfs):
+            orfScores = scores[bounds[i]:bounds[i+1]].tolist()
+            orfMeta = meta[bounds[i]:bounds[i+1]]
+
+            for j in range(len(orfMeta)):
+                orf.scores[int(orfMeta[j][key])] = orfScores[j]
+
+            self.call_orf(job.contig, orf)
+
+    def call_orf(self, contig, orf):
+        """Add an RMB feature at the best start of a scored ORF, if it reaches the cutoff and its stop is free."""
+
+        if not orf.scores:
+            return
+
+        # Features called earlier in this run can also claim the stop
+        if not self.overwrite and contig.has_stop(orf.strand, orf.right if orf.strand == '+' else orf.left):
+            return
+
+        # The first of equally good starts wins
+        start, score = max(orf.scores.items(), key=lambda item: item[1])
+        if score < self.cutoff:
+            return
+
+        if orf.strand == '+':
+            left, right = start, orf.right
+        else:
+            left, right = orf.left, start
+        f = Feature(contig.cid, left, right, orf.strand, 'CDS', 'RMB', other='rmbscore=%.6f'%(score))
+        f.gtoDict['id'] = 'RMB|%.6f'%(score)
+        contig.add_feature(f)
+        self.metrics.count('rmb_features')
+
 def score_orfs(contig, genomeGC, contigGC, startL, startR, stopL, stopR, codingSize, cutoff, startModel, stopModel, codingModel, scoreModel, overwrite=False):
-    startLoc2Pred, stopLoc2Pred, startLoc2CodingPred, stopLoc2CodingPred = calc_loc_preds(
-        dna=contig.dnaPos,
-        starts=[(start, orf.right-start, orf.right-orf.left) for orf in contig.orfs if orf.strand == '+' for start in orf.starts],
-        stops=[(orf.right-3, orf.right-orf.left) for orf in contig.orfs if orf.strand == '+'],
-        genomeGC=genomeGC,
-        contigGC=contigGC,
-        startL=90,
-        startR=90,
-        stopL=90,
-        stopR=90,
-        codingSize=33,
+    scheduler = InferenceScheduler(
         startModel=startModel,
         stopModel=stopModel,
         codingModel=codingModel,
+        scoreModel=scoreModel,
+        cutoff=cutoff,
+        startL=startL,
+        startR=startR,
+        stopL=stopL,
+        stopR=stopR,
+        codingSize=codingSize,
+        overwrite=overwrite,
     )
+    scheduler.add_contig(contig, genomeGC, contigGC)
+    scheduler.finish()
+
+class PredictionCache(object):
+    """An on-disk cache of the ORFs and ORF scores of contigs, shared between runs.
+
+    Entries are keyed by the MD5 of the contig sequence, the fingerprint of the models and every other
+    input to the models, so a hit can stand in for find_orfs and inference.  Each entry is one .npz file.
+    Hits refresh the file time, and prune removes the least recently used files once the cache holds
+    more than maxBytes.
+    """
+
+    def __init__(self, directory, fingerprint, maxBytes):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, contig, genomeGC, startL, startR, stopL, stopR, codingSize, stages=()):
+        """Return the cache key of a contig scored with these parameters.
+
+        stages are the pruners and gates that dropped candidates, as their key methods describe them.
+        """
+
+        parts = (contig.md5, self.fingerprint, repr(genomeGC), startL, startR, stopL, stopR, codingSize) + tuple(stage.key(contig) for stage in stages)
+        return hashlib.sha1(' '.join(str(part) for part in parts).encode('ascii')).hexdigest()
+
+    def get(self, key):
+        """Return the scored ORFs stored under the key, or None if it is not cached."""
+
+        path = os.path.join(self.directory, key+'.npz')
+        try:
+            with np.load(path) as entry:
+                orfs = self._unpack(entry)
+            os.utime(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return orfs
+
+    def put(self, key, orfs):
+        """Store the scored ORFs of a contig under the key."""
+
+        # Write to a temporary file first, so that readers in other processes never see part of an entry
+        fd, tmpName = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **self._pack(orfs))
+            os.replace(tmpName, os.path.join(self.directory, key+'.npz'))
+        except BaseException:
+            os.unlink(tmpName)
+            raise
+
+    def prune(self):
+        """Remove the least recently used entries until the cache fits in maxBytes."""
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @staticmethod
+    def _pack(orfs):
+        startCounts = [len(orf.starts) for orf in orfs]
+        scoreCounts = [len(orf.scores) for orf in orfs]
+
+        return {
+            'left': np.array([orf.left for orf in orfs], dtype=np.int64),
+            'right': np.array([orf.right for orf in orfs], dtype=np.int64),
+            'minus': np.array([orf.strand == '-' for orf in orfs], dtype=bool),
+            'frame': np.array([orf.frame for orf in orfs], dtype=np.int8),
+            'startBounds': np.concatenate(([0], np.cumsum(startCounts))).astype(np.int64),
+            'starts': np.array([start for orf in orfs for start in orf.starts], dtype=np.int64),
+            'scoreBounds': np.concatenate(([0], np.cumsum(scoreCounts))).astype(np.int64),
+            'scoreStarts': np.array([start for orf in orfs for start in orf.scores], dtype=np.int64),
+            'scores': np.array([score for orf in orfs for score in orf.scores.values()], dtype=np.float64),
+        }
+
+    @staticmethod
+    def _unpack(entry):
+        left = entry['left'].tolist()
+        right = entry['right'].tolist()
+        minus = entry['minus'].tolist()
+        frame = entry['frame'].tolist()
+        startBounds = entry['startBounds'].tolist()
+        starts = entry['starts'].tolist()
+        scoreBounds = entry['scoreBounds'].tolist()
+        scoreStarts = entry['scoreStarts'].tolist()
+        scores = entry['scores'].tolist()
+
+        orfs = []
+        for i in range(len(left)):
+            orf = ORF(left[i], right[i], starts[startBounds[i]:startBounds[i+1]], '-' if minus[i] else '+', frame[i])
+            orf.scores = dict(zip(scoreStarts[scoreBounds[i]:scoreBounds[i+1]], scores[scoreBounds[i]:scoreBounds[i+1]]))
+            orfs.append(orf)
+
+        return orfs
+
+# Extension and first line of checkpoint journals
+journalSuffix = '.checkpoint'
+journalMagic = b'RMBJRNL1\n'
+
+class ContigJournal(object):
+    """An append-only journal of the scored ORFs of each contig finished in a run, for resuming it.
+
+    The file starts with the magic line and a JSON line holding the model fingerprint, followed by one
+    record per contig: an 8-byte length and an .npz holding the contig ID, its key and its packed ORFs.
+    Records are synced to disk as the InferenceScheduler finishes contigs.  A journal with another
+    fingerprint is started over, and a record cut short by a crash is dropped.
+
+    A contig is only resumed if its key still matches, so a changed sequence, feature set, genome GC
+    content or pruning setting scores it again.  Its RMB features are called again from the ORF scores,
+    as for prediction cache hits.
+    """
+
+    def __init__(self, fname, fingerprint):
+        self.fname = fname
+        self.fingerprint = fingerprint
+        self.entries = {}
+        self.added = 0
+        header = journalMagic + (json.dumps({'fingerprint': fingerprint}) + '\n').encode('ascii')
+
+        good = 0
+        try:
+            with open(fname, 'rb') as f:
+                if f.read(len(header)) == header:
+                    good = len(header)
+                    while True:
+                        size = f.read(8)
+                        if len(size) < 8:
+                            break
+                        payload = f.read(int.from_bytes(size, 'little'))
+                        try:
+                            with np.load(io.BytesIO(payload)) as entry:
+                                self.entries[str(entry['cid'])] = (str(entry['key']), PredictionCache._unpack(entry))
+                        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                            break
+                        good = f.tell()
+        except FileNotFoundError:
+            pass
+
+        # Drop whatever follows the last whole record, or start over
+        if good > 0:
+            self.f = open(fname, 'r+b')
+            self.f.truncate(good)
+            self.f.seek(good)
+        else:
+            self.f = open(fname, 'wb')
+            self.f.write(header)
+            self.sync()
+
+    def key(self, contig, genomeGC, stages=()):
+        """Return the journal key of a contig scored with these settings."""
+
+        parts = (rmb_state(contig), repr(genomeGC)) + tuple(stage.key(contig) for stage in stages)
+        return hashlib.sha1(' '.join(str(part) for part in parts).encode('ascii')).hexdigest()
+
+    def get(self, contig, key):
+        """Return the scored ORFs of a contig finished by an earlier run, or None."""
+
+        entry = self.entries.get(contig.cid)
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1]
+
+    def add(self, contig, key):
+        """Append the scored ORFs of a finished contig."""
+
+        buf = io.BytesIO()
+        np.savez(buf, cid=np.array(contig.cid), key=np.array(key), **PredictionCache._pack(contig.orfs))
+        payload = buf.getvalue()
+        self.f.write(len(payload).to_bytes(8, 'little'))
+        self.f.write(payload)
+        self.added += 1
+
+    def sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self, remove=False):
+        self.f.close()
+        if remove:
+            os.unlink(self.fname)
+
+def np_sigmoid(x):
+    """The logistic function, computed without overflow for inputs of either sign."""
+
+    e = np.exp(-np.abs(x))
+    return np.where(x >= 0, 1 / (1 + e), e / (1 + e))
+
+def np_activation(name):
+    """Return a NumPy version of a named Keras activation function."""
+
+    if isinstance(name, dict):
+        name = name.get('config', {}).get('name', name.get('class_name'))
+
+    if name in (None, 'linear'):
+        return lambda x: x
+    if name == 'relu':
+        return lambda x: np.maximum(x, 0)
+    if name == 'sigmoid':
+        return np_sigmoid
+    if name == 'tanh':
+        return np.tanh
+    if name == 'softmax':
+        def softmax(x):
+            e = np.exp(x - x.max(axis=-1, keepdims=True))
+            return e / e.sum(axis=-1, keepdims=True)
+        return softmax
+    if name == 'elu':
+        return lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+    if name == 'selu':
+        return lambda x: 1.0507009873554805 * np.where(x > 0, x, 1.6732632423543772 * np.expm1(np.minimum(x, 0)))
+    if name == 'softplus':
+        return lambda x: np.logaddexp(x, 0)
+    if name == 'softsign':
+        return lambda x: x / (1 + np.abs(x))
+    if name in ('swish', 'silu'):
+        return lambda x: x * np_sigmoid(x)
+    if name == 'exponential':
+        return np.exp
+
+    raise ValueError('The NumPy backend does not support the %r activation' % name)
+
+def np_pad_1d(x, span, stride, padding):
+    """Pad the steps of a (batch, steps, channels) array for a window of the given span."""
+
+    if padding == 'same':
+        steps = x.shape[1]
+        total = max((-(-steps // stride) - 1) * stride + span - steps, 0)
+        return np.pad(x, ((0, 0), (total//2, total - total//2), (0, 0)))
+    if padding == 'causal':
+        return np.pad(x, ((0, 0), (span-1, 0), (0, 0)))
+
+    return x
+
+def np_windows_1d(x, size, stride, dilation=1):
+    """Return the (batch, steps, channels, size) sliding windows of a (batch, steps, channels) array."""
+
+    span = (size-1)*dilation + 1
+    windows = np.lib.stride_tricks.sliding_window_view(x, span, axis=1)
+
+    return windows[:, ::stride, :, ::dilation]
+
+def np_lstm(x, kernel, recurrentKernel, bias, config, goBackwards):
+    units = recurrentKernel.shape[0]
+    activation = np_activation(config.get('activation', 'tanh'))
+    recurrentActivation = np_activation(config.get('recurrent_activation', 'sigmoid'))
+
+    steps = range(x.shape[1]-1, -1, -1) if goBackwards else range(x.shape[1])
+    inputs = np.tensordot(x, kernel, axes=1)
+    if bias is not None:
+        inputs = inputs + bias
+
+    h = np.zeros((x.shape[0], units), dtype=x.dtype)
+    c = np.zeros((x.shape[0], units), dtype=x.dtype)
+    outputs = []
+    for t in steps:
+        z = inputs[:,t] + h @ recurrentKernel
+        i = recurrentActivation(z[:,:units])
+        f = recurrentActivation(z[:,units:2*units])
+        c = f*c + i*activation(z[:,2*units:3*units])
+        o = recurrentActivation(z[:,3*units:])
+        h = o*activation(c)
+        outputs.append(h)
+
+    if config.get('return_sequences'):
+        return np.stack(outputs, axis=1)
+
+    return h
+
+def np_layer(className, config, weights, inputs):
+    """Evaluate one Keras layer on NumPy inputs."""
+
+    x = inputs[0]
+
+    if className in ('InputLayer', 'Dropout', 'SpatialDropout1D', 'GaussianNoise', 'GaussianDropout', 'AlphaDropout', 'ActivityRegularization'):
+        return x
+
+    if className == 'Dense':
+        y = np.tensordot(x, weights[0], axes=1)
+        if config.get('use_bias', True):
+            y = y + weights[1]
+        return np_activation(config.get('activation'))(y)
+
+    if className == 'Embedding':
+        return weights[0][x.astype(np.int32)]
+
+    if className == 'Conv1D':
+        if config.get('data_format', 'channels_last') != 'channels_last':
+            raise ValueError('The NumPy backend only supports channels_last convolutions')
+        kernel = weights[0]
+        size = kernel.shape[0]
+        stride = config['strides'][0] if isinstance(config['strides'], (list, tuple)) else config['strides']
+        dilation = config['dilation_rate'][0] if isinstance(config['dilation_rate'], (list, tuple)) else config['dilation_rate']
+        x = np_pad_1d(x, (size-1)*dilation + 1, stride, config.get('padding', 'valid'))
+        windows = np_windows_1d(x, size, stride, dilation)
+        y = np.einsum('bsck,kco->bso', windows, kernel, optimize=True)
+        if config.get('use_bias', True):
+            y = y + weights[1]
+        return np_activation(config.get('activation'))(y)
+
+    if className in ('MaxPooling1D', 'AveragePooling1D'):
+        size = config['pool_size'][0] if isinstance(config['pool_size'], (list, tuple)) else config['pool_size']
+        stride = config.get('strides') or size
+        stride = stride[0] if isinstance(stride, (list, tuple)) else stride
+        if config.get('padding', 'valid') == 'same' and className == 'MaxPooling1D':
+            total = max((-(-x.shape[1] // stride) - 1) * stride + size - x.shape[1], 0)
+            x = np.pad(x, ((0, 0), (total//2, total - total//2), (0, 0)), constant_values=-np.inf)
+        elif config.get('padding', 'valid') == 'same':
+            raise ValueError('The NumPy backend does not support same padding for average pooling')
+        windows = np_windows_1d(x, size, stride)
+        return windows.max(axis=-1) if className == 'MaxPooling1D' else windows.mean(axis=-1)
+
+    if className == 'GlobalMaxPooling1D':
+        return x.max(axis=1, keepdims=bool(config.get('keepdims')))
+
+    if className == 'GlobalAveragePooling1D':
+        return x.mean(axis=1, keepdims=bool(config.get('keepdims')))
+
+    if className == 'Flatten':
+        return x.reshape(len(x), -1)
+
+    if className == 'Reshape':
+        return x.reshape((len(x),) + tuple(config['target_shape']))
+
+    if className == 'Activation':
+        return np_activation(config['activation'])(x)
+
+    if className == 'ReLU':
+        return np.maximum(x, 0)
+
+    if className == 'LeakyReLU':
+        slope = config.get('negative_slope', config.get('alpha', 0.3))
+        return np.where(x > 0, x, slope*x)
+
+    if className == 'BatchNormalization':
+        axis = config.get('axis', -1)
+        axis = axis[0] if isinstance(axis, (list, tuple)) else axis
+        weights = list(weights)
+        gamma = weights.pop(0) if config.get('scale', True) else None
+        beta = weights.pop(0) if config.get('center', True) else None
+        mean, variance = weights
+
+        shape = [1]*x.ndim
+        shape[axis] = -1
+        y = (x - mean.reshape(shape)) / np.sqrt(variance.reshape(shape) + config.get('epsilon', 1e-3))
+        if gamma is not None:
+            y = y*gamma.reshape(shape)
+        if beta is not None:
+            y = y + beta.reshape(shape)
+        return y
+
+    if className == 'Concatenate':
+        return np.concatenate(inputs, axis=config.get('axis', -1))
+
+    if className == 'Add':
+        return sum(inputs[1:], inputs[0])
+
+    if className == 'Multiply':
+        y = inputs[0]
+        for z in inputs[1:]:
+            y = y*z
+        return y
+
+    if className == 'LSTM':
+        if config.get('return_state'):
+            raise ValueError('The NumPy backend does not support LSTM states')
+        bias = weights[2] if config.get('use_bias', True) else None
+        return np_lstm(x, weights[0], weights[1], bias, config, config.get('go_backwards', False))
+
+    if className == 'Bidirectional':
+        inner = config['layer']
+        if inner['class_name'] != 'LSTM':
+            raise ValueError('The NumPy backend only supports bidirectional LSTM layers')
+        innerConfig = inner['config']
+        half = len(weights)//2
+        bias = (lambda w: w[2] if innerConfig.get('use_bias', True) else None)
+        forward = np_lstm(x, weights[0], weights[1], bias(weights[:half]), innerConfig, innerConfig.get('go_backwards', False))
+        backward = np_lstm(x, weights[half], weights[half+1], bias(weights[half:]), innerConfig, not innerConfig.get('go_backwards', False))
+        if innerConfig.get('return_sequences'):
+            backward = backward[:, ::-1]
+        mode = config.get('merge_mode', 'concat')
+        if mode == 'concat':
+            return np.concatenate([forward, backward], axis=-1)
+        if mode == 'sum':
+            return forward + backward
+        if mode == 'mul':
+            return forward * backward
+        if mode == 'ave':
+            return (forward + backward) / 2
+        raise ValueError('The NumPy backend does not support the %r merge mode' % mode)
+
+    raise ValueError('The NumPy backend does not support %s layers' % className)
+
+def np_tensor_refs(node):
+    """Return the (layer, node, tensor) references of one inbound node, from a Keras 2 or Keras 3 config."""
+
+    if not isinstance(node, dict):
+        return [(ref[0], ref[1], ref[2]) for ref in node]
+
+    refs = []
+    def walk(x):
+        if isinstance(x, dict) and x.get('class_name') == '__keras_tensor__':
+            refs.append(tuple(x['config']['keras_history']))
+        elif isinstance(x, (list, tuple)):
+            for y in x:
+                walk(y)
+    walk(node['args'])
+
+    return refs
+
+class NumpyModel(object):
+    """A Keras model evaluated with NumPy alone, loaded from its h5 file or a converted npz copy.
+
+    The h5 file is read with h5py the first time and converted to an npz file next to it, when the
+    directory is writable, so later loads need neither Tensorflow nor h5py.  The npz records the size and
+    SHA-1 of the h5 it came from, and is converted again if they no longer match or it cannot be read.
+    predict behaves like the Keras method for the layers the module supports.
+    """
+
+    def __init__(self, fname):
+        npzName = os.path.splitext(fname)[0] + '.npz'
+        source = self.source(fname)
+        try:
+            with np.load(npzName) as f:
+                config = json.loads(str(f['config']))
+                if config.get('source') != source:
+                    raise ValueError('%s was converted from another %s' % (npzName, fname))
+                weights = {name: [f['%s:%d' % (name, i)] for i in range(int(f['%s:count' % name]))] for name in config['weighted']}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            config, weights = self.convert(fname, npzName, source)
+
+        self.weights = weights
+        self.setup(config['model'])
+
+    @staticmethod
+    def source(fname):
+        """Return the size and SHA-1 of an h5 model, which identify the npz converted from it."""
+
+        h = hashlib.sha1()
+        with open(fname, 'rb') as f:
+            for block in iter(functools.partial(f.read, 2**20), b''):
+                h.update(block)
+
+        return {'size': os.path.getsize(fname), 'sha1': h.hexdigest()}
+
+    @staticmethod
+    def convert(fname, npzName, source=None):
+        """Read the config and weights of an h5 model, saving them to an npz file if possible."""
+
+        import h5py
+
+        with h5py.File(fname, 'r') as f:
+            modelConfig = f.attrs['model_config']
+            modelConfig = json.loads(modelConfig.decode('utf-8') if isinstance(modelConfig, bytes) else modelConfig)
+            group = f['model_weights'] if 'model_weights' in f else f
+
+            weights = {}
+            for name in group:
+                names = [n.decode('utf-8') if isinstance(n, bytes) else str(n) for n in group[name].attrs.get('weight_names', [])]
+                if len(names) > 0:
+                    weights[name] = [np.asarray(group[name][n]) for n in names]
+
+        config = {'model': modelConfig, 'weighted': sorted(weights), 'source': source or NumpyModel.source(fname)}
+
+        arrays = {'config': np.array(json.dumps(config))}
+        for name, layerWeights in weights.items():
+            arrays['%s:count' % name] = np.array(len(layerWeights))
+            for i, w in enumerate(layerWeights):
+                arrays['%s:%d' % (name, i)] = w
+
+        # Write to a temporary file first, so that concurrent loads never see part of the npz
+        tmpName = '%s.%d.tmp' % (npzName, os.getpid())
+        try:
+            with open(tmpName, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmpName, npzName)
+        except OSError:
+            try:
+                os.unlink(tmpName)
+            except OSError:
+                pass
+
+        return config, weights
+
+    def setup(self, modelConfig):
+        """Lay out the layer graph of a Functional or Sequential model config."""
+
+        config = modelConfig['config']
+        self.layers = []
+        self.inputShapes = []
+
+        def layer_name(layer):
+            return layer.get('name') or layer['config']['name']
+
+        def refs(spec):
+            return [tuple(spec)] if isinstance(spec[0], str) else [tuple(ref) for ref in spec]
+
+        if modelConfig['class_name'] == 'Sequential':
+            layers = config['layers'] if isinstance(config, dict) else config
+            self.inputShapes.append(layers[0]['config'].get('batch_input_shape') or layers[0]['config'].get('batch_shape'))
+            previous = ('input', 0, 0)
+            self.inputs = [previous]
+            for layer in layers:
+                if layer['class_name'] != 'InputLayer':
+                    self.layers.append((layer['class_name'], layer['config'], layer_name(layer), 0, [previous]))
+                    previous = (layer_name(layer), 0, 0)
+            self.outputs = [previous]
+        else:
+            for layer in config['layers']:
+                name = layer_name(layer)
+                nodes = layer.get('inbound_nodes') or []
+                if layer['class_name'] == 'InputLayer':
+                    self.layers.append(('InputLayer', layer['config'], name, 0, []))
+                for nodeIndex, node in enumerate(nodes):
+                    self.layers.append((layer['class_name'], layer['config'], name, nodeIndex, np_tensor_refs(node)))
+            self.inputs = refs(config['input_layers'])
+            self.outputs = refs(config['output_layers'])
+            inputConfigs = {layer_name(layer): layer['config'] for layer in config['layers'] if layer['class_name'] == 'InputLayer'}
+            for name, node, tensor in self.inputs:
+                self.inputShapes.append(inputConfigs[name].get('batch_input_shape') or inputConfigs[name].get('batch_shape'))
+
+    def predict(self, inputs, batch_size=4096, **kwargs):
+        """Evaluate the model on a list of input arrays, batch_size rows at a time."""
+
+        if not isinstance(inputs, (list, tuple)):
+            inputs = [inputs]
+
+        inputs = [self.shape_input(np.asarray(x), shape) for x, shape in zip(inputs, self.inputShapes)]
+        rows = len(inputs[0])
+
+        parts = [self.evaluate([x[i:i+batch_size] for x in inputs]) for i in range(0, rows, batch_size)]
+        if len(parts) == 0:
+            parts = [self.evaluate([x[:0] for x in inputs])]
+        outputs = [np.concatenate([part[j] for part in parts]) for j in range(len(self.outputs))]
+
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    @staticmethod
+    def shape_input(x, shape):
+        x = x.astype(np.float32)
+        if shape is not None and None not in shape[1:] and x.shape[1:] != tuple(shape[1:]):
+            x = x.reshape((len(x),) + tuple(shape[1:]))
+        return x
+
+    def evaluate(self, inputs):
+        tensors = {}
+        for (name, node, tensor), x in zip(self.inputs, inputs):
+            tensors[(name, node, tensor)] = x
+
+        for className, config, name, nodeIndex, refs in self.layers:
+            if (name, nodeIndex, 0) in tensors:
+                continue
+            y = np_layer(className, config, self.weights.get(name, []), [tensors[ref] for ref in refs])
+            tensors[(name, nodeIndex, 0)] = y.astype(np.float32, copy=False)
 
-    for orf in contig.orfs:
-        if orf.strand != '+':
-            continue
+        return [tensors[ref] for ref in self.outputs]
 
+# The models of a model directory, in the order load_models returns them
+modelNames = ('start', 'stop', 'coding', 'score')
 
-        if not overwrite:
-            l = [f.right == orf.right for f in contig.features]
-            if any(l):
-                continue
+@functools.lru_cache(maxsize=None)
+def model_fingerprint(modelDirectory):
+    """Return a hash of the contents of the models in the model directory.
 
-        pointPreds, isCorrect, meta = combine_orf_preds(
-            orf,
-            startLoc2Pred,
-            stopLoc2Pred,
-            startLoc2CodingPred,
-            stopLoc2CodingPred,
-        )
+    It is computed once per process, just as the models are only loaded once.
+    """
 
-        if len(pointPreds) == 0:
-            continue
+    h = hashlib.sha1()
+    for name in modelNames:
+        with open(os.path.join(modelDirectory, name+'.h5'), 'rb') as f:
+            h.update(name.encode('ascii'))
+            for block in iter(functools.partial(f.read, 2**20), b''):
+                h.update(block)
+
+    return h.hexdigest()
+
+def load_models(modelDirectory, backend='keras'):
+    """Load the start, stop, coding and score models from the model directory.
+
+    The keras backend loads them with Tensorflow.  The numpy backend evaluates them with NumpyModel, and
+    never imports Tensorflow.
+    """
+
+    names = [os.path.join(modelDirectory, name+'.h5') for name in modelNames]
+
+    if backend == 'numpy':
+        return tuple(NumpyModel(name) for name in names)
 
-        pointPreds = np.array(pointPreds)
-        scores = scoreModel.predict([pointPreds], batch_size=4096)
+    from keras.models import load_model
+    tf_nowarn()
+    tf_threads()
+
+    return tuple(load_model(name, compile=False) for name in names)
+
+def annotate(args, models):
+    """Call RMB genes on the GTO named by args.input and save the result to args.output.
 
-        for i in range(len(meta)):
-            orf.scores[int(meta[i][0])] = float(scores[i])
+    Unless args.no_metrics is set, the timings and counts of the run are saved to args.metrics, or next to
+    the output GTO.  With args.trace_memory, allocations are traced with tracemalloc for the run, so the
+    metrics hold the peak memory of each stage and contig.
+    """
 
-        if scores.max() >= cutoff:
-            # for sample in meta:
-            best = meta[scores.argmax()]
+    if not args.trace_memory or tracemalloc.is_tracing():
+        return annotate_genome(args, models)
 
-            left = int(best[0])
-            right = int(best[1])
-            f = Feature(contig.cid, left, right, '+', 'CDS', 'RMB', other='rmbscore=%.6f'%(orf.scores[left]))
-            f.gtoDict['id'] = 'RMB|%.6f'%(orf.scores[left])
-            contig.features.append(f)
+    tracemalloc.start()
+    try:
+        return annotate_genome(args, models)
+    finally:
+        tracemalloc.stop()
 
-    ####################################################################################################
-    ####################################################################################################
-    ####################################################################################################
+def annotate_genome(args, models):
+    """Call RMB genes on the genome named by args.input and save the result to args.output, as annotate does."""
 
-    startLoc2Pred, stopLoc2Pred, startLoc2CodingPred, stopLoc2CodingPred = calc_loc_preds(
-        dna=contig.dnaNeg,
-        starts=[(len(contig.dnaNeg)-start, start-orf.left, orf.right-orf.left) for orf in contig.orfs if orf.strand == '-' for start in orf.starts],
-        stops=[(len(contig.dnaNeg)-orf.left-3, orf.right-orf.left) for orf in contig.orfs if orf.strand == '-'],
-        genomeGC=genomeGC,
-        contigGC=contigGC,
+    startModel, stopModel, codingModel, scoreModel = models
+    metrics = Metrics()
+    resource_settings(args)
+    metrics.resources = resource_report(args)
+
+    if args.verbose:
+        print('Loading genome', file=sys.stderr)
+    with metrics.stage('read_gto'):
+        genome = read_genome(args.input, args.gff, args.genome_id, args.genetic_code)
+    if args.bam:
+        with metrics.stage('read_bam'):
+            genome.add_bam(args.bam, args.bam_workers, args.rna_profile_dir)
+
+    if args.verbose:
+        print('Doing', genome, file=sys.stderr)
+
+    # Candidates can be dropped ahead of the models by overlap with existing features and by the cascade
+    pruners = []
+    if args.prune_overlap > 0:
+        pruners.append(OverlapPruner(args.prune_overlap, args.prune_strand))
+    sequenceFilter, gate = cascade_stages(args)
+    if sequenceFilter is not None:
+        pruners.append(sequenceFilter)
+    stages = pruners + ([gate] if gate is not None else [])
+
+    genomeGC = genome.gc
+    fingerprint = model_fingerprint(args.modelDirectory)
+
+    journal = None
+    if args.checkpoint:
+        journal = ContigJournal(args.output+journalSuffix, fingerprint)
+
+    scheduler = InferenceScheduler(
+        startModel=startModel,
+        stopModel=stopModel,
+        codingModel=codingModel,
+        scoreModel=scoreModel,
+        cutoff=0.5,
         startL=90,
         startR=90,
         stopL=90,
         stopR=90,
         codingSize=33,
-        startModel=startModel,
-        stopModel=stopModel,
-        codingModel=codingModel,
+        overwrite=False,
+        batchSize=args.batch_size,
+        memLimit=args.mem_limit*2**20,
+        dedup=not args.no_dedup,
+        metrics=metrics,
+        gate=gate,
+        journal=journal,
     )
 
-    for orf in contig.orfs:
-        if orf.strand != '-':
-            continue
-
-        if not overwrite:
-            l = [f.left == orf.left for f in contig.features]
-            if any(l):
+    # Incremental runs only call genes on the contigs that changed since the last run
+    todo = genome.contigs
+    if args.incremental:
+        todo = changed_contigs(genome, fingerprint)
+        changed = set(id(contig) for contig in todo)
+        for contig in genome.contigs:
+            if id(contig) not in changed:
+                metrics.add_contig(contig, 'unchanged')
+        if args.verbose:
+            print('Calling genes on', len(todo), 'of', len(genome.contigs), 'contigs', file=sys.stderr)
+
+    # Contigs finished before an earlier run on the same output was stopped are called from its journal
+    journalKeys = {}
+    if journal is not None:
+        contigs = todo
+        todo = []
+        for contig in contigs:
+            key = journal.key(contig, genomeGC, stages)
+            orfs = journal.get(contig, key)
+            if orfs is None:
+                journalKeys[contig.cid] = key
+                todo.append(contig)
+                continue
+            contig.orfs = orfs
+            for orf in orfs:
+                scheduler.call_orf(contig, orf)
+            metrics.add_contig(contig, 'resumed')
+        if args.verbose:
+            print('Resumed', len(contigs)-len(todo), 'of', len(contigs), 'contigs from', journal.fname, file=sys.stderr)
+
+    # Contigs found in the cache are called straight away, and only the rest are prepared and scored
+    cache = None
+    if args.cache:
+        cache = PredictionCache(args.cache, fingerprint, args.cache_size*2**20)
+        contigs = todo
+        todo = []
+        for contig in contigs:
+            with metrics.stage('cache_get'):
+                key = cache.key(contig, genomeGC, 90, 90, 90, 90, 33, stages)
+                orfs = cache.get(key)
+            if orfs is None:
+                todo.append((contig, key))
                 continue
+            if args.verbose:
+                print('  Cached', contig, file=sys.stderr)
+            contig.orfs = orfs
+            for orf in orfs:
+                scheduler.call_orf(contig, orf)
+            metrics.add_contig(contig, 'cached')
+        cacheKeys = [key for contig, key in todo]
+        todo = [contig for contig, key in todo]
+
+    # Contigs with more candidates than fit in a chunk are prepared a chunk at a time as they are queued
+    maxRows = None
+    if args.chunk_mb > 0:
+        maxRows = max(1, int(args.chunk_mb*2**20) // window_row_bytes(90, 90, 90, 90, 33))
+
+    # Cached entries must not depend on the features of the contig, so then every ORF is scored and the
+    # scheduler leaves out the ones whose stops are taken
+    overwrite = cache is not None
+    prepArgs = ((contig, genomeGC, contig.gc, 90, 90, 90, 90, 33, overwrite, maxRows, pruners) for contig in todo)
+
+    # Batch workers do not start workers of their own
+    if args.prep_workers > 1 and not is_worker():
+        # The workers only run NumPy code, so they can safely be forked from a process that has loaded the models
+        pool = multiprocessing.get_context('fork').Pool(args.prep_workers)
+        prepared = ordered_map(pool, prepare_contig, prepArgs, 2*args.prep_workers)
+    else:
+        pool = None
+        prepared = (prepare_contig(*contigArgs) for contigArgs in prepArgs)
+
+    # The memory of a contig covers preparing it here and the model runs its inputs set off
+    prepared = iter(prepared)
+    try:
+        for contig in todo:
+            memory = {}
+            with metrics.memory(memory):
+                orfs, strands, stats = next(prepared)
+                contig.orfs = orfs
+                if args.verbose:
+                    print('  Doing', contig, file=sys.stderr)
+                if strands is not None:
+                    scheduler.add_prepared(contig, strands)
+                else:
+                    for strand in '+-':
+                        chunks = strand_chunks(contig, strand, genomeGC, contig.gc, 90, 90, 90, 90, 33, overwrite, stats, maxRows, pruners)
+                        for chunk in timed(chunks, stats, 'windows_seconds'):
+                            scheduler.add_prepared(contig, [(strand, chunk)])
+                            stats['chunks'] += 1
+            scheduler.end_contig(contig, journalKeys.get(contig.cid))
+            metrics.add_contig(contig, 'scored', stats, memory)
+
+            # The windows are built, so a contig read from a FASTA file can let its sequence go until it is saved
+            contig.unload()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    scheduler.finish()
+
+    # Count the calls on each contig once they are all in
+    for entry in metrics.contigs:
+        entry['rmb_features'] = sum(1 for f in genome.get_contig_by_id(entry['id']).features if f.source == 'RMB')
 
-        pointPreds, isCorrect, meta = combine_orf_preds(
-            orf,
-            startLoc2Pred,
-            stopLoc2Pred,
-            startLoc2CodingPred,
-            stopLoc2CodingPred,
-            dnalen=len(contig.dnaNeg),
-        )
+    if args.verbose:
+        for name, (rows, distinct) in scheduler.rowCounts.items():
+            if rows > 0:
+                print('  %s model: %d rows, %d distinct (%.2fx dedup)' % (name, rows, distinct, rows/distinct), file=sys.stderr)
+
+    if cache is not None:
+        with metrics.stage('cache_put'):
+            for contig, key in zip(todo, cacheKeys):
+                cache.put(key, contig.orfs)
+            cache.prune()
+        metrics.count('cache_hits', cache.hits)
+        metrics.count('cache_misses', cache.misses)
+        if args.verbose:
+            print('Prediction cache: %d hits, %d misses' % (cache.hits, cache.misses), file=sys.stderr)
 
-        if len(pointPreds) == 0:
-            continue
+    with metrics.stage('save_gto'):
+        eventId = add_rmb_event(genome, fingerprint, contigStates=args.incremental)
+        save_gto(args.output, genome, pretty=args.pretty, eventId=eventId, sidecar=args.sidecar or genome.sidecar)
 
-        pointPreds = np.array(pointPreds)
-        scores = scoreModel.predict([pointPreds], batch_size=4096)
+    # The output is complete, so nothing is left to resume
+    if journal is not None:
+        metrics.count('journaled_contigs', journal.added)
+        journal.close(remove=True)
 
-        for i in range(len(meta)):
-            orf.scores[int(meta[i][1])] = float(scores[i])
+    if args.verbose:
+        metrics.report()
+    if not args.no_metrics:
+        metrics.save(args.metrics or args.output+'.metrics.json')
+
+# Options that a job may not override
+serverOptions = ('modelDirectory', 'backend', 'serve', 'socket', 'batch', 'output_dir', 'workers', 'threads', 'inter_op_threads', 'blas_threads', 'cpus', 'mem_budget', 'show_resources')
+
+def run_job(job, args, models):
+    """Run one job and return its reply.
+
+    A job is a dictionary with "input" and "output" GTO file names, plus optionally any other command-line
+    option by its argument name (for example "verbose" or "batch_size").  The reply has a "status" of
+    "ok" or "error", and an "error" message for failed jobs.  A failed job never raises.
+    """
+
+    t0 = time.time()
+    try:
+        jobArgs = argparse.Namespace(**vars(args))
+        for key, value in job.items():
+            if key in serverOptions or not hasattr(jobArgs, key):
+                raise ValueError('Invalid job option %r' % key)
+            setattr(jobArgs, key, value)
+        if not jobArgs.input or not jobArgs.output:
+            raise ValueError('Jobs require an input and an output')
+
+        # Keep model progress output off of the reply stream
+        with contextlib.redirect_stdout(sys.stderr):
+            annotate(jobArgs, models)
+        reply = {'status': 'ok', 'output': jobArgs.output}
+    except Exception as e:
+        reply = {'status': 'error', 'error': '%s: %s' % (type(e).__name__, e)}
+
+    reply['seconds'] = round(time.time()-t0, 3)
+    if args.verbose:
+        print('Job finished', reply, file=sys.stderr)
+
+    return reply
+
+def run_job_line(line, args, models):
+    """Run one JSON-encoded job and return its JSON-encoded reply."""
+
+    try:
+        job = json.loads(line)
+    except ValueError as e:
+        return json.dumps({'status': 'error', 'error': '%s: %s' % (type(e).__name__, e)})
+
+    return json.dumps(run_job(job, args, models))
+
+def serve_stream(inStream, outStream, args, models):
+    """Run JSON-lines jobs from an input stream until it ends, writing one reply line per job."""
+
+    for line in inStream:
+        if line.strip():
+            print(run_job_line(line, args, models), file=outStream, flush=True)
+
+def free_socket(path):
+    """Remove the socket file left at path by a server that is gone, or fail if a server still answers there."""
+
+    if not os.path.exists(path):
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        else:
+            raise RuntimeError('An export server is already running on %s' % path)
+
+    os.unlink(path)
+
+def serve_socket(path, args, models):
+    """Run JSON-lines jobs from clients of a Unix socket, one job at a time, until interrupted."""
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write((run_job_line(line.decode('utf-8'), args, models) + '\n').encode('utf-8'))
+                    self.wfile.flush()
+
+    free_socket(path)
+    server = socketserver.UnixStreamServer(path, JobHandler)
+    if args.verbose:
+        print('Serving on', path, file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def batch_jobs(source, outDir):
+    """List the jobs for a batch directory or manifest file.
+
+    A directory yields one job for each .gto file in it.  A manifest has one input GTO file name per line,
+    optionally followed by a tab and an output file name.  Relative output names are put in outDir, which
+    also receives the outputs that are not named.
+    """
+
+    pairs = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.endswith('.gto'):
+                pairs.append((os.path.join(source, name), name))
+    else:
+        with open(source) as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if not fields[0] or fields[0].startswith('#'):
+                    continue
+                if len(fields) > 1 and fields[1]:
+                    pairs.append((fields[0], fields[1]))
+                else:
+                    pairs.append((fields[0], os.path.basename(fields[0])))
+
+    return [{'input': inFile, 'output': os.path.join(outDir, outFile)} for inFile, outFile in pairs]
+
+# Models of a batch worker process, loaded once by init_batch_worker
+workerModels = None
+
+def init_batch_worker(args):
+    global workerModels
+
+    tf_nowarn()
+    apply_resources(args)
+    workerModels = load_models(args.modelDirectory, args.backend)
+
+def run_batch_job(job, args):
+    return job, run_job(job, args, workerModels)
+
+def pool_jobs(func, jobs, workers, initializer=None, initargs=()):
+    """Run func on each job with a pool of spawned worker processes, yielding each job, its result and an error message as it finishes.
+
+    The error message is None for jobs that finished.  A worker that dies outright, say killed for using
+    too much memory, breaks the pool.  The pool is then started again and the jobs that were running are
+    retried one at a time, so that only the job that killed its worker fails and the rest carry on.
+    """
+
+    # Tensorflow does not survive a fork, so each worker starts fresh
+    context = multiprocessing.get_context('spawn')
+    queue = collections.deque(jobs)
+    retries = collections.deque()
+
+    while queue or retries:
+        pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context, initializer=initializer, initargs=initargs)
+        running = {}
+        try:
+            while queue or retries or running:
+                if retries:
+                    if not running:
+                        job = retries.popleft()
+                        running[pool.submit(func, job)] = job
+                else:
+                    while queue and len(running) < workers:
+                        job = queue.popleft()
+                        running[pool.submit(func, job)] = job
+
+                done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                suspects = []
+                for future in done:
+                    job = running.pop(future)
+                    error = future.exception()
+                    if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+                        suspects.append(job)
+                    elif error is not None:
+                        yield job, None, '%s: %s' % (type(error).__name__, error)
+                    else:
+                        yield job, future.result(), None
+                if not suspects:
+                    continue
+
+                # Every running job failed with the pool, and a job that was running alone is the one that broke it
+                suspects.extend(running.values())
+                running = {}
+                if len(suspects) == 1:
+                    yield suspects[0], None, 'Worker process died'
+                else:
+                    retries.extend(suspects)
+                break
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def pool_batch_jobs(jobs, args):
+    """Run batch jobs on args.workers worker processes with pool_jobs, yielding each job and its reply as it finishes."""
+
+    for job, result, error in pool_jobs(functools.partial(run_batch_job, args=args), jobs, args.workers, init_batch_worker, (args,)):
+        if error is None:
+            yield result
+        else:
+            yield job, {'status': 'failed', 'error': error}
 
-        if scores.max() >= cutoff:
-            # for sample in meta:
-            best = meta[scores.argmax()]
+def run_batch(args):
+    """Annotate every GTO of a batch with a pool of worker processes, and return the number that failed."""
 
-            left = int(best[0])
-            right = int(best[1])
-            f = Feature(contig.cid, left, right, '-', 'CDS', 'RMB', other='rmbscore=%.6f'%(orf.scores[right]))
-            f.gtoDict['id'] = 'RMB|%.6f'%(orf.scores[right])
-            contig.features.append(f)
+    jobs = batch_jobs(args.batch, args.output_dir)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.verbose:
+        print('Annotating', len(jobs), 'genomes with', args.workers, 'workers', file=sys.stderr)
+
+    t0 = time.time()
+    if args.workers <= 1:
+        init_batch_worker(args)
+        results = (run_batch_job(job, args) for job in jobs)
+    else:
+        results = pool_batch_jobs(jobs, args)
+
+    failed = 0
+    for job, reply in results:
+        if reply['status'] == 'ok':
+            print('%s\tok\t%.1f' % (job['input'], reply['seconds']), file=sys.stderr)
+        else:
+            failed += 1
+            print('%s\tfailed\t%s' % (job['input'], reply['error']), file=sys.stderr)
+
+    elapsed = time.time() - t0
+    print('%d genomes annotated, %d failed, in %.1f seconds (%.1f genomes/hour)' % (len(jobs)-failed, failed, elapsed, 3600*(len(jobs)-failed)/elapsed if elapsed > 0 else 0), file=sys.stderr)
+
+    return failed
 
 def main(args):
+    if args.show_resources:
+        print(json.dumps(resource_report(args), indent=3))
+        return 0
+
     if args.verbose:
-        print('Loading genome', file=sys.stderr)
-    genome = read_gto(args.input)
+        print('Resources', json.dumps(resource_report(args)), file=sys.stderr)
+
+    if args.batch:
+        return 1 if run_batch(args) else 0
+
+    # Refuse to take over the socket of a running server before spending time on the models
+    if args.socket:
+        free_socket(args.socket)
 
     if args.verbose:
         print('Loading models', file=sys.stderr)
-    startModel = load_model(os.path.join(args.modelDirectory, 'start.h5'), compile=False)
-    stopModel = load_model(os.path.join(args.modelDirectory, 'stop.h5'), compile=False)
-    codingModel = load_model(os.path.join(args.modelDirectory, 'coding.h5'), compile=False)
-    scoreModel = load_model(os.path.join(args.modelDirectory, 'score.h5'), compile=False)
+    models = load_models(args.modelDirectory, args.backend)
 
-    if args.verbose:
-        print('Doing', genome, file=sys.stderr)
-    genomeGC = genome.gc
-    for contig in genome.contigs:
-        contig.find_orfs()
-        if args.verbose:
-            print('  Doing', contig, file=sys.stderr)
-        contigGC = contig.gc
-
-        score_orfs(
-            contig=contig,
-            genomeGC=genomeGC,
-            contigGC=contigGC,
-            startL=90,
-            startR=90,
-            stopL=90,
-            stopR=90,
-            codingSize=33,
-            cutoff=0.5,
-            startModel=startModel,
-            stopModel=stopModel,
-            codingModel=codingModel,
-            scoreModel=scoreModel,
-            overwrite=False,
-        )
+    if args.socket:
+        serve_socket(args.socket, args, models)
+    elif args.serve:
+        # Replies go to the real standard output, so grab it before jobs redirect it
+        serve_stream(sys.stdin, sys.stdout, args, models)
+    else:
+        annotate(args, models)
 
-    save_gto(args.output, genome)
+    return 0
+
+def build_parser():
+    """Return the command-line parser, which other scripts also use to get the default options."""
 
-if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
     parser.add_argument('-g', '--gpu', type=str, default='-1', help='Comma separated list of GPUs to use')
-    parser.add_argument('--input', type=str, help='GTO input file')
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='keras', help='Run the models with Keras, or with NumPy alone')
+    parser.add_argument('--input', type=str, help='GTO input file, or FASTA file of contigs, which may be gzipped')
+    parser.add_argument('--gff', type=str, help='GFF file of the existing features of a FASTA input')
+    parser.add_argument('--genome-id', type=str, default='99.99', help='Genome ID of a FASTA input')
+    parser.add_argument('--genetic-code', type=int, default=11, help='Genetic code of a FASTA input')
+    parser.add_argument('--bam', type=str, help='Indexed .bam file of RNA-Seq reads aligned to the contigs, whose coverage is loaded onto them')
+    parser.add_argument('--bam-workers', type=int, default=1, help='Number of worker processes counting RNA-Seq coverage, one contig at a time')
+    parser.add_argument('--rna-profile-dir', type=str, help='Directory to write the RNA-Seq coverage profiles to as .npy files, which are then mapped rather than held in memory')
     parser.add_argument('--output', type=str, help='GTO output file')
+    parser.add_argument('--batch-size', type=int, help='Number of rows per model batch (default 4096, or sized to --mem-budget)')
+    parser.add_argument('--no-dedup', action='store_true', help='Send every candidate window to the models, even if an identical one was already sent')
+    parser.add_argument('--metrics', type=str, help='JSON file for the timings and counts of the run (default the output GTO name plus .metrics.json)')
+    parser.add_argument('--trace-memory', action='store_true', help='Trace allocations with tracemalloc, so the metrics hold the peak memory of each stage and contig (slower)')
+    parser.add_argument('--no-metrics', action='store_true', help='Do not save the timings and counts of the run')
+    parser.add_argument('--sidecar', action='store_true', help='Write the contig sequences to a binary sidecar next to the output GTO (implied by an input with one)')
+    parser.add_argument('--pretty', action='store_true', help='Indent the output GTO for reading')
+    parser.add_argument('--mem-limit', type=int, help='Megabytes of model input to queue before running the models (default 512, or sized to --mem-budget)')
+    parser.add_argument('--cache', type=str, default=os.environ.get('EXPORT_CACHE'), help='Directory of cached contig predictions to reuse and add to (default $EXPORT_CACHE)')
+    parser.add_argument('--cache-size', type=int, default=2048, help='Megabytes the prediction cache may hold before the least recently used entries are removed')
+    parser.add_argument('--checkpoint', action='store_true', help='Journal each contig as it is finished, and resume from the journal of an earlier run on the same output that was stopped')
+    parser.add_argument('--incremental', action='store_true', help='Only call genes again on contigs that changed since the last run on the input GTO')
+    parser.add_argument('--chunk-mb', type=float, help='Megabytes of model input to build at once for a large contig; 0 builds each contig in one piece (default 64, or sized to --mem-budget)')
+    parser.add_argument('--prune-overlap', type=float, default=0, help='Skip candidate genes with at least this fraction inside one existing CDS; 0 scores them all')
+    parser.add_argument('--prune-strand', choices=['same', 'opposite', 'any'], default='any', help='Strand of the existing CDS features that prune candidates')
+    parser.add_argument('--min-gene-length', type=int, help='Cascade: skip candidate genes shorter than this many bases')
+    parser.add_argument('--start-codons', type=str, help='Cascade: comma-separated start codons to score, such as ATG,GTG (default all)')
+    parser.add_argument('--rbs-motifs', type=str, help='Cascade: skip starts without one of these comma-separated motifs, such as GGAG,GAGG, just upstream')
+    parser.add_argument('--min-stop-score', type=float, help='Cascade: skip ORFs whose stop model prediction is below this')
+    parser.add_argument('--min-coding-score', type=float, help='Cascade: skip ORFs whose coding prediction ahead of the stop is below this')
+    parser.add_argument('--fast', action='store_true', help='Use the fast cascade for any cascade option not given (%s)' % ', '.join('%s %s' % (k, v) for k, v in fastCascade.items()))
+    parser.add_argument('--prep-workers', type=int, default=os.environ.get('EXPORT_PREP_WORKERS', 1), help='Number of worker processes that find ORFs and build model inputs (default $EXPORT_PREP_WORKERS or 1)')
+    parser.add_argument('--threads', type=int, default=os.environ.get('EXPORT_THREADS'), help='Inference threads per process (default $EXPORT_THREADS, or the usable CPUs shared between batch workers)')
+    parser.add_argument('--inter-op-threads', type=int, default=os.environ.get('EXPORT_INTER_OP_THREADS'), help='Tensorflow threads for running independent operations at once (default $EXPORT_INTER_OP_THREADS or 2)')
+    parser.add_argument('--blas-threads', type=int, default=os.environ.get('EXPORT_BLAS_THREADS'), help='NumPy and BLAS threads per process (default $EXPORT_BLAS_THREADS or --threads)')
+    parser.add_argument('--cpus', type=str, default=os.environ.get('EXPORT_CPUS'), help='CPUs to run on, such as 0-7,16 (default $EXPORT_CPUS or all allowed)')
+    parser.add_argument('--mem-budget', type=int, default=os.environ.get('EXPORT_MEM_BUDGET'), help='Soft megabytes of model input for the run, which sizes the model batches, queues and chunks that are not given; contig sequences and ORFs come on top (default $EXPORT_MEM_BUDGET)')
+    parser.add_argument('--show-resources', action='store_true', help='Print the effective thread, CPU and memory settings as JSON and exit')
+    parser.add_argument('--serve', action='store_true', help='Keep the models loaded and run JSON-lines jobs from standard input')
+    parser.add_argument('--socket', type=str, help='Keep the models loaded and run JSON-lines jobs from this Unix socket')
+    parser.add_argument('--batch', type=str, help='Directory of GTOs, or manifest of GTO file names, to annotate in one run')
+    parser.add_argument('--output-dir', type=str, default='.', help='Directory for the output GTOs of a batch')
+    parser.add_argument('--workers', type=int, default=os.environ.get('EXPORT_WORKERS', 1), help='Number of worker processes for a batch (default $EXPORT_WORKERS or 1)')
     parser.add_argument('modelDirectory', type=str, help='Which directory the model is in')
-    args = parser.parse_args()
+
+    return parser
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
 
     # Avoid the plethora of tensorflow debug messages
     tf_nowarn()
-    select_gpu(args.gpu)
+    select_gpu(args.gpu, args.verbose)
+    apply_resources(args)
 
-    main(args)
+    sys.exit(main(args))
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for the hot paths of the export GeneCall module."""
+
+import sys
+import os
+import argparse
+import time
+import re
+import json
+import itertools
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import export
+
+# Packages that must only be imported once the models are needed
+heavyModules = ('tensorflow', 'keras', 'sklearn', 'h5py')
+
+def random_dna(length, gc, rng):
+    """Generate a random lower-case DNA sequence with the given GC fraction."""
+
+    p = [(1-gc)/2, gc/2, gc/2, (1-gc)/2]
+    return rng.choice(np.frombuffer(b'acgt', dtype=np.uint8), size=length, p=p).tobytes().decode('ascii')
+
+def legacy_find_orfs(dna, strand):
+    """The original regex and list scan from Contig._find_orfs, kept as the benchmark baseline."""
+
+    orfs = []
+
+    naL = [[], [], []]
+    for match in re.finditer(r'(?=[agt]tg)', dna):
+        loc = match.start()
+        naL[loc%3].append(loc)
+
+    noL = [[0], [1], [2]]
+    for match in re.finditer(r'(?=taa|tag|tga)', dna):
+        loc = match.start()
+        noL[loc%3].append(loc+3)
+
+    for frame in range(3):
+        j = -1
+        for i in range(len(noL[frame])-1):
+            front = noL[frame][i]
+            back = noL[frame][i+1]
+
+            starts = []
+            for j in range(j+1, len(naL[frame])):
+                if naL[frame][j] >= back:
+                    j -= 1
+                    break
+                starts.append(naL[frame][j])
+
+            if len(starts) > 0:
+                if strand == '+':
+                    orf = export.ORF(front, back, starts, strand, frame)
+                else:
+                    orf = export.ORF(len(dna)-back, len(dna)-front, list(reversed([len(dna)-start for start in starts])), strand, frame)
+                orfs.append(orf)
+
+    return orfs
+
+def orf_key(orf):
+    return (orf.left, orf.right, tuple(orf.starts), orf.strand, orf.frame)
+
+def best_time(func, repeat):
+    """Return the best wall time of several calls to func, along with its last result."""
+
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rv = func()
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, rv
+
+class StubModel(object):
+    """A tiny deterministic stand-in for one of the RMB models, taking the same inputs.
+
+    Each output is a fixed random projection of the row through a sigmoid, or a softmax for outputs with
+    more than one class.  Every row is computed on its own, so the predictions do not depend on batching.
+    """
+
+    def __init__(self, name, outputs, seed):
+        self.name = name
+        self.outputs = outputs
+        self.seed = seed
+        self.weights = {}
+
+    def predict(self, inputs, batch_size=4096, **kwargs):
+        x = np.hstack([np.asarray(column, dtype=np.float32).reshape(len(column), -1) for column in inputs])
+
+        # Centre and scale each row, so the outputs spread across (0, 1) whatever the inputs are
+        x = x - x.mean(axis=1, keepdims=True)
+        x /= x.std(axis=1, keepdims=True) + 1
+
+        preds = []
+        for i, width in enumerate(self.outputs):
+            key = (x.shape[1], i)
+            if key not in self.weights:
+                self.weights[key] = np.random.default_rng((self.seed, x.shape[1], i)).normal(size=(x.shape[1], width)).astype(np.float32) / np.sqrt(x.shape[1])
+            z = x @ self.weights[key]
+            if width == 1:
+                preds.append(1 / (1 + np.exp(-z)))
+            else:
+                z = np.exp(z - z.max(axis=1, keepdims=True))
+                preds.append(z / z.sum(axis=1, keepdims=True))
+
+        return preds if len(preds) > 1 else preds[0]
+
+def stub_models(directory):
+    """Return stub start, stop, coding and score models, with placeholder model files in directory.
+
+    annotate fingerprints the model files, so each placeholder names its stub.
+    """
+
+    models = (
+        StubModel('start', (1, 1), 1),
+        StubModel('stop', (1,), 2),
+        StubModel('coding', (2,), 3),
+        StubModel('score', (1,), 4),
+    )
+    for model in models:
+        with open(os.path.join(directory, model.name+'.h5'), 'w') as f:
+            print('stub', model.name, model.outputs, model.seed, file=f)
+
+    return models
+
+def synthetic_gto(fname, mbp, contigs, gc, featureDensity, rng):
+    """Write a GTO of random contigs totalling mbp megabases, with featureDensity PATRIC features per Mbp."""
+
+    gid = '99999.1'
+    lengths = np.full(contigs, int(mbp*1e6) // contigs)
+    lengths[:int(mbp*1e6) % contigs] += 1
+
+    gto = {'id': gid, 'scientific_name': 'Synthetic genome', 'contigs': [], 'features': []}
+    for i, length in enumerate(lengths):
+        cid = 'contig%d' % (i+1)
+        gto['contigs'].append({'id': cid, 'dna': random_dna(int(length), gc, rng), 'genetic_code': 11})
+
+        for j in range(int(featureDensity*length/1e6)):
+            size = 3*int(rng.integers(100, 600))
+            if size >= length:
+                continue
+            start = int(rng.integers(1, length-size+1))
+            if rng.random() < 0.5:
+                location = [cid, start, '+', size]
+            else:
+                location = [cid, start+size-1, '-', size]
+            gto['features'].append({'id': 'fig|%s.peg.%d' % (gid, len(gto['features'])+1), 'type': 'CDS', 'location': [location], 'function': 'synthetic protein'})
+
+    with open(fname, 'w') as f:
+        json.dump(gto, f)
+
+def strand_candidates(contig, strand):
+    """Build the start and stop candidates of one strand of a contig, as prepare_strand does, for calc_loc_preds."""
+
+    codes = contig.codes(strand)
+    n = len(codes)
+    orfs = [orf for orf in contig.orfs if orf.strand == strand]
+    if strand == '+':
+        starts = [(start, orf.right-start, orf.right-orf.left) for orf in orfs for start in orf.starts]
+        stops = [(orf.right-3, orf.right-orf.left) for orf in orfs]
+    else:
+        starts = [(n-start, start-orf.left, orf.right-orf.left) for orf in orfs for start in orf.starts]
+        stops = [(n-orf.left-3, orf.right-orf.left) for orf in orfs]
+
+    return codes, orfs, starts, stops
+
+# Stages of run_pipeline, in order
+pipelineStages = ('read_gto', 'find_orfs', 'calc_loc_preds', 'combine_orf_preds', 'score_orfs', 'save_gto', 'annotate')
+
+def run_pipeline(gtoName, outName, models, modelDirectory, trace=False):
+    """Run each stage of gene calling over a GTO once.
+
+    Returns the seconds and the peak traced bytes of each stage, the number of base pairs and the number of
+    candidate starts.  The last stage, annotate, runs the whole of export from the GTO file again.
+    """
+
+    startModel, stopModel, codingModel, scoreModel = models
+    stats = {}
+
+    def stage(name, func):
+        if trace:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        rv = func()
+        elapsed = time.perf_counter() - t0
+        peak = 0
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        stats[name] = (elapsed, peak)
+        return rv
+
+    genome = stage('read_gto', lambda: export.read_gto(gtoName))
+    genomeGC = genome.gc
+
+    def find_orfs():
+        for contig in genome.contigs:
+            contig.find_orfs()
+
+    def calc_loc_preds():
+        rv = []
+        for contig, strand in itertools.product(genome.contigs, '+-'):
+            codes, orfs, starts, stops = strand_candidates(contig, strand)
+            rv.append((orfs, len(codes), export.calc_loc_preds(codes, starts, stops, genomeGC, contig.gc, 90, 90, 90, 90, 33, startModel, stopModel, codingModel)))
+        return rv
+
+    def combine_orf_preds():
+        candidates = 0
+        for orfs, dnalen, locPreds in strandPreds:
+            for orf in orfs:
+                candidates += len(export.combine_orf_preds(orf, *locPreds, dnalen=dnalen)[0])
+        return candidates
+
+    def score_orfs():
+        for contig in genome.contigs:
+            export.score_orfs(contig, genomeGC, contig.gc, 90, 90, 90, 90, 33, 0.5, startModel, stopModel, codingModel, scoreModel)
+
+    def annotate():
+        args = export.build_parser().parse_args(['--input', gtoName, '--output', outName, modelDirectory])
+        export.annotate(args, models)
+
+    stage('find_orfs', find_orfs)
+    strandPreds = stage('calc_loc_preds', calc_loc_preds)
+    candidates = stage('combine_orf_preds', combine_orf_preds)
+    stage('score_orfs', score_orfs)
+    stage('save_gto', lambda: export.save_gto(outName, genome))
+    stage('annotate', annotate)
+
+    return stats, sum(contig.length for contig in genome.contigs), candidates
+
+def bench_pipeline(args):
+    """Time each stage of gene calling, and the whole run, on synthetic genomes with stub models."""
+
+    rng = np.random.default_rng(args.seed)
+
+    print('%6s %7s %5s %-18s %9s %9s %13s %9s' % ('Mbp', 'contigs', 'gc', 'stage', 'seconds', 'Mbp/s', 'candidates/s', 'peak MB'))
+    with tempfile.TemporaryDirectory() as tmpDir:
+        models = stub_models(tmpDir)
+        gtoName = os.path.join(tmpDir, 'genome.gto')
+        outName = os.path.join(tmpDir, 'out.gto')
+
+        for mbp, contigs, gc in itertools.product(args.sizes, args.contigs, args.gc):
+            synthetic_gto(gtoName, mbp, contigs, gc, args.feature_density, rng)
+
+            # The best time of each stage over the repeats, and then the peak memory of a traced run
+            best = {}
+            for _ in range(args.repeat):
+                stats, bp, candidates = run_pipeline(gtoName, outName, models, tmpDir)
+                for name, (elapsed, peak) in stats.items():
+                    best[name] = min(best.get(name, elapsed), elapsed)
+            traced, bp, candidates = run_pipeline(gtoName, outName, models, tmpDir, trace=True)
+
+            for name in pipelineStages:
+                elapsed = best[name]
+                print('%6g %7d %5.2f %-18s %9.3f %9.3f %13.0f %9.1f' % (mbp, contigs, gc, name, elapsed, bp/elapsed/1e6, candidates/elapsed, traced[name][1]/2**20))
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('Peak resident memory: %.1f MB' % (maxrss / (2**20 if sys.platform == 'darwin' else 2**10)))
+
+# Cascade settings compared against the full path by default, as export options
+cascadeSettings = (
+    '--min-gene-length 90',
+    '--min-gene-length 150',
+    '--start-codons ATG,GTG',
+    '--rbs-motifs GGAG,GAGG,AGGA',
+    '--min-stop-score 0.05 --min-coding-score 0.05',
+    '--min-stop-score 0.2 --min-coding-score 0.2',
+    '--fast',
+)
+
+def gene_calls(gtoName):
+    """Return the location of every feature in a GTO."""
+
+    genome = export.read_gto(gtoName)
+    return set((contig.cid, f.left, f.right, f.strand) for contig in genome.contigs for f in contig.features)
+
+def run_export(gtoName, outName, models, modelDirectory, options):
+    """Run export with extra options, returning its seconds and its metrics counters."""
+
+    metricsName = outName + '.metrics.json'
+    args = export.build_parser().parse_args(['--input', gtoName, '--output', outName, '--metrics', metricsName] + options.split() + [modelDirectory])
+    t0 = time.perf_counter()
+    export.annotate(args, models)
+    elapsed = time.perf_counter() - t0
+    with open(metricsName) as f:
+        counters = json.load(f)['counters']
+
+    return elapsed, counters
+
+def bench_cascade(args):
+    """Compare cascaded scoring against the full path, trading the calls kept for the candidates scored."""
+
+    rng = np.random.default_rng(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        if args.modelDirectory:
+            models = export.load_models(args.modelDirectory, args.backend)
+            modelDirectory = args.modelDirectory
+        else:
+            models = stub_models(tmpDir)
+            modelDirectory = tmpDir
+        gtoName = args.input
+        if not gtoName:
+            gtoName = os.path.join(tmpDir, 'genome.gto')
+            synthetic_gto(gtoName, args.size, args.contigs, args.gc, args.feature_density, rng)
+        outName = os.path.join(tmpDir, 'out.gto')
+
+        # New calls are the features export added to the input; the first run only warms up the models
+        existing = gene_calls(gtoName)
+        run_export(gtoName, outName, models, modelDirectory, '')
+        fullTime, fullCounters = run_export(gtoName, outName, models, modelDirectory, '')
+        full = gene_calls(outName) - existing
+
+        print('%-45s %9s %8s %13s %7s %7s %9s' % ('cascade', 'seconds', 'speedup', 'scored starts', 'calls', 'recall', 'precision'))
+        print('%-45s %9.3f %7.1fx %13d %7d %7.3f %9.3f' % ('(full path)', fullTime, 1, fullCounters.get('scored_starts', 0), len(full), 1, 1))
+        for options in args.setting or cascadeSettings:
+            elapsed, counters = run_export(gtoName, outName, models, modelDirectory, options)
+            calls = gene_calls(outName) - existing
+            kept = len(calls & full)
+            print('%-45s %9.3f %7.1fx %13d %7d %7.3f %9.3f' % (options, elapsed, fullTime/elapsed, counters.get('scored_starts', 0), len(calls),
+                    kept/len(full) if full else 1, kept/len(calls) if calls else 1))
+
+def bench_orfs(args):
+    """Compare the vectorized ORF finder against the legacy regex scan."""
+
+    rng = np.random.default_rng(args.seed)
+
+    print('%8s %8s %14s %14s %8s %10s' % ('Mbp', 'gc', 'legacy s/Mbp', 'numpy s/Mbp', 'speedup', 'orfs'))
+    for mbp in args.sizes:
+        dna = random_dna(int(mbp*1e6), args.gc, rng)
+
+        contig = export.Contig(cid='bench')
+        contig.dnaPos = dna
+
+        def run_new():
+            contig.orfs = []
+            contig.find_orfs()
+            return contig.orfs
+
+        def run_legacy():
+            return legacy_find_orfs(contig.dnaPos, '+') + legacy_find_orfs(contig.dnaNeg, '-')
+
+        newTime, newOrfs = best_time(run_new, args.repeat)
+        oldTime, oldOrfs = best_time(run_legacy, args.repeat)
+
+        if [orf_key(o) for o in newOrfs] != [orf_key(o) for o in oldOrfs]:
+            print('ERROR: ORFs differ from the legacy scan at %g Mbp' % mbp, file=sys.stderr)
+            sys.exit(1)
+
+        print('%8g %8.2f %14.3f %14.3f %7.1fx %10d' % (mbp, args.gc, oldTime/mbp, newTime/mbp, oldTime/newTime, len(newOrfs)))
+
+def bench_startup(args):
+    """Time how long export takes to start in a fresh interpreter."""
+
+    scriptDir = os.path.dirname(os.path.abspath(__file__))
+    prelude = 'import sys; sys.path.insert(0, %r); import export; ' % scriptDir
+
+    checks = [
+        ('import', [sys.executable, '-c', prelude]),
+        ('--help', [sys.executable, os.path.join(scriptDir, 'export.py'), '--help']),
+    ]
+    if args.modelDirectory:
+        for backend in ('numpy', 'keras'):
+            checks.append(('load ' + backend, [sys.executable, '-c', prelude + 'export.load_models(%r, %r)' % (args.modelDirectory, backend)]))
+
+    failed = False
+
+    # Importing the module must not drag in any of the heavy packages
+    heavy = subprocess.run([sys.executable, '-c', prelude + 'print(" ".join(m for m in %r if m in sys.modules))' % (heavyModules,)],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+    if heavy:
+        print('ERROR: importing export loads %s' % ', '.join(heavy), file=sys.stderr)
+        failed = True
+
+    print('%12s %10s' % ('step', 'seconds'))
+    for name, command in checks:
+        elapsed, rv = best_time(lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), args.repeat)
+        print('%12s %10.3f' % (name, elapsed))
+        if name in ('import', '--help') and elapsed > args.limit:
+            print('ERROR: %s took longer than %g seconds' % (name, args.limit), file=sys.stderr)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+def bench_parity(args):
+    """Compare the NumPy model backend against Keras on random inputs."""
+
+    rng = np.random.default_rng(args.seed)
+    kerasModels = export.load_models(args.modelDirectory, 'keras')
+    numpyModels = export.load_models(args.modelDirectory, 'numpy')
+
+    worst = 0
+    print('%8s %12s %12s %12s' % ('model', 'max diff', 'keras s', 'numpy s'))
+    for name, kerasModel, numpyModel in zip(('start', 'stop', 'coding', 'score'), kerasModels, numpyModels):
+        # Multi-column inputs get DNA codes and single columns get GC-like fractions
+        inputs = []
+        for shape in numpyModel.inputShapes:
+            if shape is not None and len(shape) > 1 and shape[-1] not in (None, 1):
+                inputs.append(rng.integers(0, len(export.dnaAll), size=(args.rows,) + tuple(shape[1:])).astype(np.uint8))
+            else:
+                inputs.append(rng.random(args.rows))
+
+        kerasTime, kerasPreds = best_time(lambda: kerasModel.predict(inputs, batch_size=4096), 1)
+        numpyTime, numpyPreds = best_time(lambda: numpyModel.predict(inputs, batch_size=4096), 1)
+        if not isinstance(kerasPreds, list):
+            kerasPreds = [kerasPreds]
+            numpyPreds = [numpyPreds]
+
+        diff = max(float(np.abs(np.asarray(k) - n).max()) for k, n in zip(kerasPreds, numpyPreds))
+        worst = max(worst, diff)
+        print('%8s %12.3g %12.3f %12.3f' % (name, diff, kerasTime, numpyTime))
+
+    if worst > args.tolerance:
+        print('ERROR: NumPy predictions differ from Keras by %g' % worst, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the export GeneCall hot paths')
+    subparsers = parser.add_subparsers(dest='bench')
+    subparsers.required = True
+
+    orfParser = subparsers.add_parser('orfs', help='Time ORF finding per Mbp against the legacy regex scan')
+    orfParser.add_argument('--sizes', type=float, nargs='+', default=[0.1, 1.0, 6.0], help='Contig sizes to test, in Mbp')
+    orfParser.add_argument('--gc', type=float, default=0.5, help='GC fraction of the random contigs')
+    orfParser.add_argument('--repeat', type=int, default=3, help='Number of timed repetitions (best is kept)')
+    orfParser.add_argument('--seed', type=int, default=1, help='Random seed')
+    orfParser.set_defaults(func=bench_orfs)
+
+    startupParser = subparsers.add_parser('startup', help='Time importing export, --help and model loading in fresh interpreters')
+    startupParser.add_argument('--repeat', type=int, default=3, help='Number of timed repetitions (best is kept)')
+    startupParser.add_argument('--limit', type=float, default=2.0, help='Most seconds that importing or --help may take')
+    startupParser.add_argument('modelDirectory', type=str, nargs='?', help='If given, also time loading the models with each backend')
+    startupParser.set_defaults(func=bench_startup)
+
+    pipelineParser = subparsers.add_parser('pipeline', help='Time each gene calling stage on synthetic genomes with stub models')
+    pipelineParser.add_argument('--sizes', type=float, nargs='+', default=[0.5, 2.0], help='Genome sizes to test, in Mbp')
+    pipelineParser.add_argument('--contigs', type=int, nargs='+', default=[1, 50], help='Contig counts to test')
+    pipelineParser.add_argument('--gc', type=float, nargs='+', default=[0.35, 0.65], help='GC fractions to test')
+    pipelineParser.add_argument('--feature-density', type=float, default=100, help='Existing PATRIC features per Mbp')
+    pipelineParser.add_argument('--repeat', type=int, default=1, help='Number of timed repetitions (best is kept)')
+    pipelineParser.add_argument('--seed', type=int, default=1, help='Random seed')
+    pipelineParser.set_defaults(func=bench_pipeline)
+
+    cascadeParser = subparsers.add_parser('cascade', help='Compare cascaded scoring settings against the full path')
+    cascadeParser.add_argument('--input', type=str, help='GTO to call genes on (default a synthetic genome)')
+    cascadeParser.add_argument('--size', type=float, default=1.0, help='Synthetic genome size, in Mbp')
+    cascadeParser.add_argument('--contigs', type=int, default=10, help='Synthetic genome contig count')
+    cascadeParser.add_argument('--gc', type=float, default=0.5, help='Synthetic genome GC fraction')
+    cascadeParser.add_argument('--feature-density', type=float, default=100, help='Existing PATRIC features per Mbp of the synthetic genome')
+    cascadeParser.add_argument('--setting', type=str, action='append', help='Cascade export options to compare, such as --setting="--min-gene-length 120"; repeat for more (default a standard set)')
+    cascadeParser.add_argument('--backend', choices=['keras', 'numpy'], default='keras', help='Model backend for a model directory')
+    cascadeParser.add_argument('--seed', type=int, default=1, help='Random seed')
+    cascadeParser.add_argument('modelDirectory', type=str, nargs='?', help='Which directory the model is in (default stub models)')
+    cascadeParser.set_defaults(func=bench_cascade)
+
+    parityParser = subparsers.add_parser('parity', help='Check the NumPy model backend against Keras')
+    parityParser.add_argument('--rows', type=int, default=10000, help='Number of random input rows per model')
+    parityParser.add_argument('--tolerance', type=float, default=1e-4, help='Largest acceptable difference in any prediction')
+    parityParser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parityParser.add_argument('modelDirectory', type=str, help='Which directory the model is in')
+    parityParser.set_defaults(func=bench_parity)
+
+    args = parser.parse_args()
+    args.func(args)
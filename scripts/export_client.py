@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""Thin client that runs an export job on a server started with export --socket.
+
+It takes the same options as export, so it can replace export in a pipeline without loading any models.
+"""
+
+import sys
+import os
+import argparse
+import json
+import socket
+
+
+def main(args):
+    job = {
+        'input': os.path.abspath(args.input),
+        'output': os.path.abspath(args.output),
+        'verbose': args.verbose,
+    }
+    if args.batch_size is not None:
+        job['batch_size'] = args.batch_size
+    if args.mem_limit is not None:
+        job['mem_limit'] = args.mem_limit
+    if args.incremental:
+        job['incremental'] = True
+    if args.fast:
+        job['fast'] = True
+    if args.checkpoint:
+        job['checkpoint'] = True
+    if args.sidecar:
+        job['sidecar'] = True
+    if args.gff:
+        job['gff'] = os.path.abspath(args.gff)
+    if args.genome_id is not None:
+        job['genome_id'] = args.genome_id
+    if args.genetic_code is not None:
+        job['genetic_code'] = args.genetic_code
+    if args.bam:
+        job['bam'] = os.path.abspath(args.bam)
+    if args.bam_workers is not None:
+        job['bam_workers'] = args.bam_workers
+    if args.rna_profile_dir:
+        job['rna_profile_dir'] = os.path.abspath(args.rna_profile_dir)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(args.socket)
+        sock.sendall((json.dumps(job) + '\n').encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        reply = json.loads(sock.makefile('r', encoding='utf-8').readline())
+
+    if reply['status'] != 'ok':
+        print('Export failed:', reply['error'], file=sys.stderr)
+        sys.exit(1)
+
+    if args.verbose:
+        print('Export finished in %.1f seconds' % reply['seconds'], file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an export job on a running export server')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    parser.add_argument('-g', '--gpu', type=str, help='Ignored; the server chooses its GPUs')
+    parser.add_argument('--input', type=str, required=True, help='GTO input file, or FASTA file of contigs, which may be gzipped')
+    parser.add_argument('--gff', type=str, help='GFF file of the existing features of a FASTA input')
+    parser.add_argument('--genome-id', type=str, help='Genome ID of a FASTA input')
+    parser.add_argument('--genetic-code', type=int, help='Genetic code of a FASTA input')
+    parser.add_argument('--bam', type=str, help='Indexed .bam file of RNA-Seq reads aligned to the contigs, whose coverage is loaded onto them')
+    parser.add_argument('--bam-workers', type=int, help='Number of worker processes counting RNA-Seq coverage, one contig at a time')
+    parser.add_argument('--rna-profile-dir', type=str, help='Directory to write the RNA-Seq coverage profiles to as .npy files, which are then mapped rather than held in memory')
+    parser.add_argument('--output', type=str, required=True, help='GTO output file')
+    parser.add_argument('--batch-size', type=int, help='Number of rows per model batch')
+    parser.add_argument('--mem-limit', type=int, help='Megabytes of model input to queue before running the models')
+    parser.add_argument('--incremental', action='store_true', help='Only call genes again on contigs that changed since the last run on the input GTO')
+    parser.add_argument('--checkpoint', action='store_true', help='Journal each contig as it is finished, and resume from the journal of an earlier run on the same output that was stopped')
+    parser.add_argument('--fast', action='store_true', help='Use the fast cascade, skipping unpromising candidates before the start and score models')
+    parser.add_argument('--sidecar', action='store_true', help='Write the contig sequences to a binary sidecar next to the output GTO')
+    parser.add_argument('--socket', type=str, default=os.environ.get('EXPORT_SOCKET'), help='Unix socket of the export server (default $EXPORT_SOCKET)')
+    parser.add_argument('modelDirectory', type=str, nargs='?', help='Ignored; the server has its models loaded')
+    args = parser.parse_args()
+
+    if not args.socket:
+        parser.error('No server socket given; use --socket or set EXPORT_SOCKET')
+
+    main(args)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+"""Extract labelled training sets for the RMB gene calling models from reference GTOs.
+
+ORFs are found and labelled by the CDS features of each reference, and the start, stop and coding model
+inputs are built exactly as export builds them for calling.  Given the models, the score model rows are
+built from their predictions as well.  Each reference is written as one or more shards of .npy arrays,
+which np.load can map with mmap_mode='r', and manifest.json in the output directory lists every shard
+with the files, shapes and types of its arrays.
+"""
+
+import sys
+import os
+import argparse
+import json
+import time
+import functools
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import export
+
+# Window sizes of the RMB models, as export uses them
+windowSizes = {'startL': 90, 'startR': 90, 'stopL': 90, 'stopR': 90, 'codingSize': 33}
+
+# The model input columns of each row set, in the order the models take them
+rowColumns = {
+    'start': ('window', 'gene_length', 'orf_length', 'genome_gc', 'contig_gc'),
+    'stop': ('window', 'orf_length', 'genome_gc', 'contig_gc'),
+    'startCoding': ('window', 'genome_gc', 'contig_gc'),
+    'stopCoding': ('window', 'genome_gc', 'contig_gc'),
+    'score': ('row',),
+}
+
+def column_dtype(column):
+    if column == 'window':
+        return np.uint8
+    elif column.endswith('_length'):
+        return np.int32
+    return np.float32
+
+class ShardWriter(object):
+    """Collects the rows of one reference and writes them out as shards of at most about shardRows start rows.
+
+    Shards always hold whole contigs.  Each shard is a .npy file per column and per label of each row set.
+    """
+
+    def __init__(self, directory, prefix, genome, shardRows):
+        self.directory = directory
+        self.prefix = prefix
+        self.genome = genome
+        self.shardRows = shardRows
+        self.shards = []
+        self._reset()
+
+    def _reset(self):
+        self.parts = {name: [] for name in rowColumns}
+        self.labels = {name: [] for name in rowColumns}
+        self.contigs = []
+        self.startRows = 0
+
+    def add(self, name, inputs, labels):
+        """Add rows to a row set, as a list of input columns and their labels."""
+
+        self.parts[name].append(inputs)
+        self.labels[name].append(labels)
+        if name == 'start':
+            self.startRows += len(labels)
+
+    def end_contig(self, cid):
+        """Mark the end of the rows of a contig, writing a shard if enough rows are waiting."""
+
+        self.contigs.append(cid)
+        if self.startRows >= self.shardRows:
+            self.flush()
+
+    def flush(self):
+        if not self.contigs:
+            return
+
+        name = '%s-%03d' % (self.prefix, len(self.shards))
+        shard = {'name': name, 'genome': self.genome, 'contigs': self.contigs, 'rows': {}, 'arrays': {}}
+        for rowSet, columns in rowColumns.items():
+            parts = self.parts[rowSet]
+            shard['rows'][rowSet] = int(sum(len(labels) for labels in self.labels[rowSet]))
+            for i, column in enumerate(columns):
+                if parts:
+                    data = np.concatenate([np.asarray(inputs[i]).reshape(len(inputs[i]), -1) for inputs in parts])
+                else:
+                    data = np.zeros((0, 1))
+                if data.shape[1] == 1 and column != 'row':
+                    data = data.ravel()
+                self._save(shard, '%s.%s' % (rowSet, column), data.astype(column_dtype(column), copy=False))
+            labels = np.concatenate(self.labels[rowSet]) if parts else np.zeros(0)
+            self._save(shard, '%s.label' % rowSet, labels.astype(np.int8, copy=False))
+
+        self.shards.append(shard)
+        self._reset()
+
+    def _save(self, shard, key, data):
+        fname = '%s.%s.npy' % (shard['name'], key)
+        np.save(os.path.join(self.directory, fname), data)
+        shard['arrays'][key] = {'file': fname, 'shape': list(data.shape), 'dtype': data.dtype.str}
+
+def score_rows(orfs, dnalen, samples, models, batchSize):
+    """Run the start, stop and coding models over a strand and build its score model rows and labels."""
+
+    startModel, stopModel, codingModel, scoreModel = models
+    startLocs, stopLocs, startInputs, stopInputs, startCodingInputs, stopCodingInputs = samples
+
+    preds = export.loc_preds_to_dicts(
+        startLocs,
+        stopLocs,
+        export.predict_unique(startModel, startInputs, batch_size=batchSize)[0],
+        export.predict_unique(stopModel, stopInputs, batch_size=batchSize)[0],
+        export.predict_unique(codingModel, startCodingInputs, batch_size=batchSize)[0],
+        export.predict_unique(codingModel, stopCodingInputs, batch_size=batchSize)[0],
+    )
+
+    rows = []
+    labels = []
+    for orf in orfs:
+        pointPreds, isCorrect, meta = export.combine_orf_preds(orf, *preds, dnalen=dnalen)
+        rows.extend(pointPreds)
+        labels.extend(isCorrect)
+
+    return np.array(rows, dtype=np.float32).reshape(len(rows), -1), np.array(labels, dtype=np.int8).reshape(-1)
+
+# Models of a worker process, loaded once by init_worker
+workerModels = None
+
+def init_worker(args):
+    global workerModels
+
+    export.tf_nowarn()
+    export.apply_resources(args)
+    if args.models:
+        workerModels = export.load_models(args.models, args.backend)
+
+def extract_genome(indexed, args):
+    """Write the shards of one reference GTO, and return its manifest entries and a status message."""
+
+    index, job = indexed
+    t0 = time.time()
+    try:
+        genome = export.read_gto(job['input'])
+        writer = ShardWriter(args.output_dir, 'g%06d' % index, job['input'], args.shard_rows)
+        for contig in genome.contigs:
+            for strand, orfs, dnalen, samples, labels in export.training_samples(contig, genome.gc, **windowSizes):
+                writer.add('start', samples[2], labels['start'])
+                writer.add('stop', samples[3], labels['stop'])
+                writer.add('startCoding', samples[4], labels['startCoding'])
+                writer.add('stopCoding', samples[5], labels['stopCoding'])
+                if workerModels is not None:
+                    rows, rowLabels = score_rows(orfs, dnalen, samples, workerModels, args.batch_size)
+                    writer.add('score', [rows], rowLabels)
+            contig.orfs = []
+            contig.coding = None
+            writer.end_contig(contig.cid)
+        writer.flush()
+    except Exception as e:
+        return index, job, [], 'failed\t%s: %s' % (type(e).__name__, e)
+
+    return index, job, writer.shards, 'ok\t%.1f' % (time.time()-t0)
+
+def pool_extract(jobs, args):
+    """Extract the references on args.workers worker processes, each loading its own models, with export.pool_jobs.
+
+    A reference whose worker dies outright is reported as failed, and the rest are still extracted.
+    """
+
+    work = functools.partial(extract_genome, args=args)
+    for (index, job), result, error in export.pool_jobs(work, enumerate(jobs), args.workers, init_worker, (args,)):
+        yield result if error is None else (index, job, [], 'failed\t%s' % error)
+
+def main(args):
+    jobs = export.batch_jobs(args.input, args.output_dir)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.verbose:
+        print('Extracting', len(jobs), 'references with', args.workers, 'workers', file=sys.stderr)
+
+    t0 = time.time()
+    if args.workers <= 1:
+        init_worker(args)
+        results = (extract_genome(indexed, args) for indexed in enumerate(jobs))
+    else:
+        results = pool_extract(jobs, args)
+
+    entries = {}
+    failed = 0
+    for index, job, shards, status in results:
+        entries[index] = shards
+        if status.startswith('failed'):
+            failed += 1
+        print('%s\t%s' % (job['input'], status), file=sys.stderr)
+
+    shards = [shard for index in sorted(entries) for shard in entries[index]]
+    manifest = {
+        'created': time.time(),
+        'models': os.path.abspath(args.models) if args.models else None,
+        'model_fingerprint': export.model_fingerprint(args.models) if args.models else None,
+        'window_sizes': windowSizes,
+        'columns': rowColumns,
+        'rows': {name: sum(shard['rows'][name] for shard in shards) for name in rowColumns},
+        'shards': shards,
+    }
+    with open(os.path.join(args.output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=3)
+
+    elapsed = time.time() - t0
+    print('%d references extracted, %d failed, %d start rows, in %.1f seconds' % (len(jobs)-failed, failed, manifest['rows']['start'], elapsed), file=sys.stderr)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract labelled RMB model training sets from reference GTOs')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
+    parser.add_argument('--output-dir', type=str, required=True, help='Directory for the shards and manifest.json')
+    parser.add_argument('--models', type=str, help='Model directory; if given, score model rows are extracted from its predictions')
+    parser.add_argument('--backend', choices=['keras', 'numpy'], default='keras', help='Run the models with Keras, or with NumPy alone')
+    parser.add_argument('--batch-size', type=int, default=4096, help='Number of rows per model batch')
+    parser.add_argument('--shard-rows', type=int, default=2**20, help='Start rows per shard; shards always hold whole contigs')
+    parser.add_argument('--workers', type=int, default=os.environ.get('EXPORT_WORKERS', 1), help='Number of worker processes (default $EXPORT_WORKERS or 1)')
+    parser.add_argument('--threads', type=int, default=os.environ.get('EXPORT_THREADS'), help='Inference threads per worker (default $EXPORT_THREADS, or the usable CPUs shared between workers)')
+    parser.add_argument('--inter-op-threads', type=int, default=os.environ.get('EXPORT_INTER_OP_THREADS'), help='Tensorflow threads for running independent operations at once (default $EXPORT_INTER_OP_THREADS or 2)')
+    parser.add_argument('--blas-threads', type=int, default=os.environ.get('EXPORT_BLAS_THREADS'), help='NumPy and BLAS threads per worker (default $EXPORT_BLAS_THREADS or --threads)')
+    parser.add_argument('--cpus', type=str, default=os.environ.get('EXPORT_CPUS'), help='CPUs to run on, such as 0-7,16 (default $EXPORT_CPUS or all allowed)')
+    parser.add_argument('input', type=str, help='Directory of reference GTOs, or manifest of GTO file names')
+
+    # Workers share the CPUs as export batch workers do; the queue sizes are not used here
+    parser.set_defaults(batch=True, mem_budget=None, mem_limit=None, chunk_mb=None)
+    args = parser.parse_args()
+
+    export.tf_nowarn()
+    export.apply_resources(args)
+
+    sys.exit(main(args))
@@ -0,0 +1,335 @@
+"""Tests of scripts/export.py that run without the RMB models."""
+
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import export
+import export_bench
+
+
+def read_object(text, chunkSize):
+    reader = export.JsonObjectReader(io.StringIO(text), chunkSize=chunkSize)
+    obj = {}
+    for key in reader.members():
+        if key == 'contigs':
+            obj[key] = list(reader.items())
+        else:
+            obj[key] = reader.value()
+    return obj
+
+
+def test_json_reader_numbers_split_anywhere():
+    text = '{"id": "1.1", "gc": 0.5123, "scale": -1.25e-3, "big": 6E+2, "n": 42, "contigs": [1.5e1, {"x": 0.25}, -7], "last": 3.0}'
+    for chunkSize in range(1, len(text)+1):
+        assert read_object(text, chunkSize) == json.loads(text), chunkSize
+
+
+def resource_args(*argv):
+    return export.build_parser().parse_args(list(argv) + ['models'])
+
+
+def test_thread_defaults_follow_cpus():
+    args = export.resource_settings(resource_args('--cpus', '0-1'))
+    assert args.threads == 2
+    assert args.blas_threads == 2
+    assert args.inter_op_threads == 2
+
+    args = export.resource_settings(resource_args('--cpus', '0', '--batch', 'gtos', '--workers', '2'))
+    assert args.threads == 1
+    assert args.blas_threads == 1
+    assert args.inter_op_threads == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason='no CPU affinity')
+def test_apply_resources_pins_before_sizing_threads():
+    allowed = os.sched_getaffinity(0)
+    cpu = min(allowed)
+    try:
+        report = export.apply_resources(resource_args('--cpus', str(cpu)))
+        assert report['cpus'] == [cpu]
+        assert report['threads'] == 1
+        assert report['blas_threads'] == 1
+    finally:
+        os.sched_setaffinity(0, allowed)
+
+
+gffText = '''##gff-version 3
+c1\tRefSeq\tregion\t1\t600\t.\t+\t.\tID=c1:1..600
+c1\tRefSeq\tgene\t10\t99\t.\t+\t.\tID=gene-A
+c1\tRefSeq\tCDS\t10\t99\t.\t+\t0\tID=cds-WP_000001.1;Parent=gene-A;product=DNA polymerase%2C beta subunit
+c1\tRefSeq\tCDS\t200\t301\t.\t-\t0\tproduct=hypothetical protein
+c1\tRefSeq\ttRNA\t400\t475\t.\t+\t.\tID=rna-1;product=tRNA-Ala
+c1\tRefSeq\trepeat_region\t500\t550\t.\t.\t.\tID=rep-1
+##FASTA
+>c1
+ACGT
+'''
+
+
+def feature_view(gto):
+    return sorted((f['id'], f['type'], f.get('function'), tuple(map(tuple, f['location'])), tuple(f.get('aliases', ()))) for f in gto['features'])
+
+
+def test_gff_features_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    fasta = tmp_path / 'g.fna'
+    fasta.write_text('>c1\n' + ''.join(rng.choice(list('ACGT'), 600)) + '\n')
+    gff = tmp_path / 'g.gff'
+    gff.write_text(gffText)
+
+    genome = export.read_genome(str(fasta), str(gff), '1.1')
+    export.save_gto(str(tmp_path / 'a.gto'), genome)
+    export.save_gto(str(tmp_path / 'b.gto'), export.read_gto(str(tmp_path / 'a.gto')))
+
+    with open(str(tmp_path / 'a.gto')) as f:
+        first = json.load(f)
+    with open(str(tmp_path / 'b.gto')) as f:
+        second = json.load(f)
+
+    assert feature_view(first) == [
+        ('fig|1.1.peg.1', 'CDS', 'DNA polymerase, beta subunit', (('c1', 10, '+', 90),), ('cds-WP_000001.1',)),
+        ('fig|1.1.peg.2', 'CDS', 'hypothetical protein', (('c1', 301, '-', 102),), ()),
+        ('fig|1.1.rna.1', 'rna', 'tRNA-Ala', (('c1', 400, '+', 76),), ('rna-1',)),
+    ]
+    assert feature_view(second) == feature_view(first)
+    assert all(not export.is_rmb_call(f) for c in export.read_gto(str(tmp_path / 'b.gto')).contigs for f in c.features)
+
+
+def test_unchanged_reruns_add_no_rmb_event():
+    genome = export.Genome(gid='1.1')
+    genome.gtoDict = {'id': '1.1'}
+    contig = export.Contig(cid='c1', genome=genome)
+    contig.dnaPos = 'atgaaacccgggttttaa' * 10
+    genome.add_contig(contig)
+
+    first = export.add_rmb_event(genome, 'abc')
+    assert export.add_rmb_event(genome, 'abc') == first
+    assert len(genome.gtoDict['analysis_events']) == 1
+
+    assert export.add_rmb_event(genome, 'def') != first
+    contig.dnaPos = 'atgccctaa' * 10
+    export.add_rmb_event(genome, 'def')
+    assert len(genome.gtoDict['analysis_events']) == 3
+
+
+@pytest.mark.parametrize('name', ['sigmoid', 'swish'])
+def test_np_activation_is_stable(name):
+    x = np.array([-1000, -30, -1, 0, 1, 30, 1000], dtype=np.float32)
+    with np.errstate(over='raise', divide='raise', invalid='raise'):
+        y = export.np_activation(name)(x)
+    safe = x[1:-1].astype(np.float64)
+    expected = 1 / (1 + np.exp(-safe))
+    if name == 'swish':
+        expected *= safe
+    assert y.dtype == np.float32
+    assert np.allclose(y[1:-1], expected, rtol=1e-6, atol=1e-12)
+    assert np.isfinite(y).all()
+
+
+def test_free_socket(tmp_path):
+    import socket
+    path = str(tmp_path / 'export.sock')
+
+    # A live server keeps its socket
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    with pytest.raises(RuntimeError):
+        export.free_socket(path)
+    assert os.path.exists(path)
+
+    # A stale one is removed
+    server.close()
+    export.free_socket(path)
+    assert not os.path.exists(path)
+    export.free_socket(path)
+
+
+def test_interval_index_matches_brute_force():
+    rng = np.random.default_rng(2)
+    for maxPairs in (1, 7, 2**20):
+        featureLefts = rng.integers(0, 5000, 300)
+        featureRights = featureLefts + rng.integers(1, 400, 300)
+        featureRights[:3] += 4000
+        queryLefts = rng.integers(0, 6000, 2000)
+        queryRights = queryLefts + rng.integers(1, 900, 2000)
+
+        index = export.IntervalIndex(featureLefts, featureRights, maxPairs=maxPairs)
+        overlaps = np.minimum(queryRights[:, None], featureRights[None, :]) - np.maximum(queryLefts[:, None], featureLefts[None, :])
+        assert np.array_equal(index.best_overlap(queryLefts, queryRights), np.maximum(overlaps.max(axis=1), 0))
+
+    assert len(export.IntervalIndex([], []).best_overlap([1], [5])) == 1
+
+
+def test_rmb_event_states():
+    genome = export.Genome(gid='1.1')
+    genome.gtoDict = {'id': '1.1'}
+    for cid, dna in (('c1', 'atgaaataa' * 20), ('c2', 'atgcccgggtga' * 20)):
+        contig = export.Contig(cid=cid, genome=genome)
+        contig.dnaPos = dna
+        genome.add_contig(contig)
+
+    # A plain run only records the digest, which says that nothing changed
+    export.add_rmb_event(genome, 'abc')
+    assert len(genome.gtoDict['analysis_events'][0]['parameters']) == 2
+    assert export.changed_contigs(genome, 'abc') == []
+    assert len(export.changed_contigs(genome, 'def')) == 2
+
+    # Incremental runs record each contig, so only the changed one is called again
+    genome.contigs[1].dnaPos = 'atgtttaaataa' * 20
+    assert len(export.changed_contigs(genome, 'abc')) == 2
+    export.add_rmb_event(genome, 'abc', contigStates=True)
+    assert len(genome.gtoDict['analysis_events'][-1]['parameters']) == 4
+    genome.contigs[0].dnaPos = 'atgggataa' * 20
+    assert [c.cid for c in export.changed_contigs(genome, 'abc')] == ['c1']
+
+
+def test_bam_coverage_in_windows(tmp_path):
+    pysam = pytest.importorskip('pysam')
+
+    rng = np.random.default_rng(3)
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'}, 'SQ': [{'SN': 'c1', 'LN': 500}, {'SN': 'c2', 'LN': 60}]}
+    reads = []
+    for i in range(300):
+        start = int(rng.integers(0, 460))
+        reads.append((0, start, 40))
+    reads.append((1, 0, 60))
+    reads.sort()
+
+    unsorted = str(tmp_path / 'reads.bam')
+    with pysam.AlignmentFile(unsorted, 'wb', header=header) as f:
+        for i, (tid, start, length) in enumerate(reads):
+            read = pysam.AlignedSegment(f.header)
+            read.query_name = 'r%d' % i
+            read.reference_id = tid
+            read.reference_start = start
+            read.cigarstring = '%dM' % length
+            read.query_sequence = 'A' * length
+            read.query_qualities = pysam.qualitystring_to_array('I' * length)
+            read.mapping_quality = 60
+            f.write(read)
+    pysam.index(unsorted)
+
+    expected = np.zeros(501, dtype=np.int64)
+    for tid, start, length in reads:
+        if tid == 0:
+            expected[start:start+length] += 1
+    expected = np.minimum(expected, export.maxRnaDepth)
+
+    for window in (7, 64, export.bamWindow):
+        assert np.array_equal(export.bam_coverage(unsorted, 'c1', window=window), expected)
+    outName = export.bam_coverage(unsorted, 'c1', str(tmp_path / 'c1.npy'), window=7)
+    assert np.array_equal(np.load(outName), expected)
+
+    genome = export.Genome()
+    for cid, length in (('c1', 500), ('c2', 60)):
+        contig = export.Contig(cid=cid, genome=genome)
+        contig.dnaPos = 'a' * length
+        genome.add_contig(contig)
+    genome.add_bam(unsorted, workers=2, profileDir=str(tmp_path / 'profiles'))
+    assert np.array_equal(genome.get_contig_by_id('c1').rnaProfile, expected)
+    assert genome.get_contig_by_id('c2').rnaProfile[:60].tolist() == [1] * 60
+
+
+@pytest.mark.parametrize('gc', [0.3, 0.5, 0.7])
+def test_vectorized_orfs_match_legacy_scan(gc):
+    rng = np.random.default_rng(int(gc*10))
+    for length in [0, 1, 2, 3, 5, 8, 60, 61, 62, 1000, 20000]:
+        contig = export.Contig(cid='c')
+        contig.dnaPos = export_bench.random_dna(length, gc, rng)
+        contig.find_orfs()
+        legacy = export_bench.legacy_find_orfs(contig.dnaPos, '+') + export_bench.legacy_find_orfs(contig.dnaNeg, '-')
+        assert [export_bench.orf_key(orf) for orf in contig.orfs] == [export_bench.orf_key(orf) for orf in legacy], length
+
+
+@pytest.fixture(scope='module')
+def stub_run(tmp_path_factory):
+    """Return a function running export with stub models on a small synthetic GTO, giving its calls and metrics."""
+
+    directory = tmp_path_factory.mktemp('stub')
+    models = export_bench.stub_models(str(directory))
+    gtoName = str(directory / 'genome.gto')
+    export_bench.synthetic_gto(gtoName, 0.1, 5, 0.5, 300, np.random.default_rng(4))
+
+    # A repeated contig gives the models duplicate rows to share
+    with open(gtoName) as f:
+        gto = json.load(f)
+    gto['contigs'].append(dict(gto['contigs'][0], id='repeat'))
+    with open(gtoName, 'w') as f:
+        json.dump(gto, f)
+    runs = []
+
+    def run(*options, output=None):
+        outName = output or str(directory / ('out%d.gto' % len(runs)))
+        runs.append(outName)
+        args = export.build_parser().parse_args(['--input', gtoName, '--output', outName] + list(options) + [str(directory)])
+        export.annotate(args, models)
+        with open(outName) as f:
+            gto = json.load(f)
+        with open(outName + '.metrics.json') as f:
+            metrics = json.load(f)
+        calls = sorted((fD['id'], json.dumps(fD['location']), fD['annotations'][0][0]) for fD in gto['features'] if 'annotations' in fD)
+        return calls, metrics
+
+    return run
+
+
+def test_dedup_keeps_calls(stub_run):
+    calls, metrics = stub_run()
+    assert len(calls) > 0
+    assert all(model['distinct_rows'] < model['rows'] for model in metrics['models'].values())
+    assert stub_run('--no-dedup')[0] == calls
+
+
+def test_chunking_keeps_calls(stub_run):
+    calls, metrics = stub_run('--chunk-mb', '0')
+    assert all('chunks' not in entry for entry in metrics['contigs'])
+    chunkedCalls, chunkedMetrics = stub_run('--chunk-mb', '0.01')
+    assert all(entry['chunks'] > 2 for entry in chunkedMetrics['contigs'])
+    assert chunkedCalls == calls
+
+
+def test_cache_keeps_calls(stub_run, tmp_path):
+    calls, metrics = stub_run()
+    cache = str(tmp_path / 'cache')
+    firstCalls, firstMetrics = stub_run('--cache', cache)
+    assert firstMetrics['counters']['cache_hits'] == 0
+    cachedCalls, cachedMetrics = stub_run('--cache', cache)
+    assert cachedMetrics['counters']['cache_hits'] == len(metrics['contigs'])
+    assert all(entry['status'] == 'cached' for entry in cachedMetrics['contigs'])
+    assert firstCalls == calls
+    assert cachedCalls == calls
+
+
+class Stopped(Exception):
+    pass
+
+
+def test_resume_keeps_calls(stub_run, tmp_path, monkeypatch):
+    calls, metrics = stub_run()
+
+    # Stop the run as soon as the first contigs are safely journaled
+    sync = export.ContigJournal.sync
+    def stopping_sync(journal):
+        sync(journal)
+        if journal.added > 0:
+            journal.f.close()
+            raise Stopped()
+    monkeypatch.setattr(export.ContigJournal, 'sync', stopping_sync)
+    outName = str(tmp_path / 'resumed.gto')
+    with pytest.raises(Stopped):
+        stub_run('--checkpoint', '--mem-limit', '1', output=outName)
+    monkeypatch.undo()
+    assert os.path.exists(outName + export.journalSuffix)
+
+    resumedCalls, resumedMetrics = stub_run('--checkpoint', '--mem-limit', '1', output=outName)
+    statuses = [entry['status'] for entry in resumedMetrics['contigs']]
+    assert 0 < statuses.count('resumed') < len(statuses)
+    assert resumedCalls == calls
+    assert not os.path.exists(outName + export.journalSuffix)